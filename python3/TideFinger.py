@@ -8,10 +8,14 @@
 import hashlib,time,requests,os
 import random,ssl,getopt,queue
 import threading,datetime
-import sys,re,sqlite3,lxml,urllib3
-from bs4 import BeautifulSoup as BS
-from Wappalyzer import Wappalyzer, WebPage
-from webanalyzer import webanalyzer
+import sys,re,json,sqlite3,urllib3
+# 各指纹引擎(bs4/lxml、Wappalyzer、webanalyzer)、流水线和规则快照模块较重，在第一次使用时才导入
+from output import JsonlWriter
+from timing import Timings, Histogram
+from profiler import RuleProfiler
+from archive import ResponseArchive, RecordingSession, RevalidatingSession, ArchiveSession, rules_version
+import httpclient
+import hostguard
 
 # Check py version
 pyversion = sys.version.split()[0]
@@ -23,6 +27,59 @@ lock = threading.Lock()
 
 pwd = os.getcwd()
 
+# 默认配置，命令行参数会覆盖
+use_proxy = False
+proxy_list = []
+check_thunder = 50
+request_timeout = 5
+# 连接超时，None时与request_timeout相同；request_timeout为读取超时
+connect_timeout = None
+# 连接失败或超时后的重试次数，同一主机连续失败多少次后熔断(0为不熔断)
+retries = 1
+failure_threshold = 5
+
+
+class ScanConfig(object):
+    '''
+    请求相关的配置，各引擎从这里读取超时、目录探测线程数和代理，不再直接读取模块变量
+    未指定的项取创建时模块级的默认配置(命令行参数会覆盖)
+    '''
+    def __init__(self, request_timeout=None, check_thunder=None, proxy_list=None, body_limits=None, rate_limits=None,
+                 connect_timeout=None, retries=None, failure_threshold=None):
+        module = sys.modules[__name__]
+        self.request_timeout = module.request_timeout if request_timeout is None else request_timeout
+        self.connect_timeout = module.connect_timeout if connect_timeout is None else connect_timeout
+        self.retries = module.retries if retries is None else retries
+        self.failure_threshold = module.failure_threshold if failure_threshold is None else failure_threshold
+        self.check_thunder = module.check_thunder if check_thunder is None else check_thunder
+        if proxy_list is None:
+            proxy_list = module.proxy_list if module.use_proxy else []
+        self.proxy_list = list(proxy_list)
+        # 响应体大小上限，键为main/probe/favicon，未指定的使用httpclient.BODY_LIMITS
+        self.body_limits = dict(body_limits or {})
+        # 限速，依次为每个主机、每个IP和全局的每秒请求数，0为不限，为空时不限速也不退避
+        self.rate_limits = tuple(rate_limits or ())
+
+    @property
+    def timeout(self):
+        '''传给requests的 (连接超时, 读取超时)'''
+        return (self.connect_timeout or self.request_timeout, self.request_timeout)
+
+    def new_guard(self):
+        return hostguard.HostGuard(self.failure_threshold, retries=self.retries)
+
+    def new_limiter(self):
+        if not self.rate_limits:
+            return None
+        import ratelimit
+        return ratelimit.RateLimiter(*self.rate_limits)
+
+    def new_proxy_pool(self):
+        if not self.proxy_list:
+            return None
+        import proxypool
+        return proxypool.ProxyPool(self.proxy_list)
+
 # Ignore warning
 urllib3.disable_warnings()
 # Ignore ssl warning info.
@@ -43,6 +100,83 @@ header_task = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8
 
 cms_finger_list =['08cms', '1039_jxt', '1039\xe5\xae\xb6\xe6\xa0\xa1\xe9\x80\x9a', '3gmeeting', '3gmeeting\xe8\xa7\x86\xe8\xae\xaf\xe7\xb3\xbb\xe7\xbb\x9f', '51fax\xe4\xbc\xa0\xe7\x9c\x9f\xe7\xb3\xbb\xe7\xbb\x9f', '53kf', '5ucms', '686_weixin', '6kbbs', '74cms', '86cms', 'afterlogicwebmail\xe7\xb3\xbb\xe7\xbb\x9f', 'appcms', 'aspcms', 'b2bbuilder', 'beescms', 'bookingecms\xe9\x85\x92\xe5\xba\x97\xe7\xb3\xbb\xe7\xbb\x9f', 'cactiez\xe6\x8f\x92\xe4\xbb\xb6', 'chinacreator', 'cxcms', 'dk\xe5\x8a\xa8\xe7\xa7\x91cms', 'doyo\xe9\x80\x9a\xe7\x94\xa8\xe5\xbb\xba\xe7\xab\x99\xe7\xb3\xbb\xe7\xbb\x9f', 'dtcms', 'dvrdvs-webs', 'datalifeengine', 'dayucms', 'dedecms', 'destoon', 'digital campus2.0', 'digitalcampus2.0', 'discuz', 'discuz7.2', 'drupal', 'dswjcms', 'duomicms', 'dvbbs', 'dzzoffice', 'ecshop', 'ec_word\xe4\xbc\x81\xe4\xb8\x9a\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', 'emlog', 'easysite\xe5\x86\x85\xe5\xae\xb9\xe7\xae\xa1\xe7\x90\x86', 'edusoho', 'empirecms', 'epaper\xe6\x8a\xa5\xe5\x88\x8a\xe7\xb3\xbb\xe7\xbb\x9f', 'epoint', 'espcms', 'fengcms', 'foosuncms', 'gentlecms', 'gever', 'glassfish', 'h5\xe9\x85\x92\xe5\xba\x97\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', 'hdwiki', 'hjcms\xe4\xbc\x81\xe4\xb8\x9a\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', 'himail', 'hishop\xe5\x95\x86\xe5\x9f\x8e\xe7\xb3\xbb\xe7\xbb\x9f', 'hituxcms', 'ilas\xe5\x9b\xbe\xe4\xb9\xa6\xe7\xb3\xbb\xe7\xbb\x9f', 'iloanp2p\xe5\x80\x9f\xe8\xb4\xb7\xe7\xb3\xbb\xe7\xbb\x9f', 'imo\xe4\xba\x91\xe5\x8a\x9e\xe5\x85\xac\xe5\xae\xa4\xe7\xb3\xbb\xe7\xbb\x9f', 'insightsoft', 'iwebshop', 'iwmscms', 'jboos', 'jishigou', 'jeecms', 'jingyi', 'joomla', 'kangle\xe8\x99\x9a\xe6\x8b\x9f\xe4\xb8\xbb\xe6\x9c\xba', 'kesioncms', 'kessioncms', 'kingcms', 'lebishop\xe7\xbd\x91\xe4\xb8\x8a\xe5\x95\x86\xe5\x9f\x8e', 'live800', 'live800\xe6\x8f\x92\xe4\xbb\xb6', 'ljcms', 'mlecms', 'mailgard', 'majexpress', 'mallbuilder', 'maticsoftsns', 'minyoocms', 'mvmmall', 'mymps\xe8\x9a\x82\xe8\x9a\x81\xe5\x88\x86\xe7\xb1\xbb\xe4\xbf\xa1\xe6\x81\xaf', 'n\xe7\x82\xb9\xe8\x99\x9a\xe6\x8b\x9f\xe4\xb8\xbb\xe6\x9c\xba', 'opensns', 'ourphp', 'php168', 'phpcms', 'phpwind', 'phpok', 'piw\xe5\x86\x85\xe5\xae\xb9\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', 'phpmyadmin', 'phpwind\xe7\xbd\x91\xe7\xab\x99\xe7\xa8\x8b\xe5\xba\x8f', 'pigcms', 'powercreator\xe5\x9c\xa8\xe7\xba\xbf\xe6\x95\x99\xe5\xad\xa6\xe7\xb3\xbb\xe7\xbb\x9f', 'powereasy', 'sapnetweaver', 'shopex', 'shop7z', 'shopnc\xe5\x95\x86\xe5\x9f\x8e\xe7\xb3\xbb\xe7\xbb\x9f', 'shopnum', 'siteserver', 'soullon', 'southidc', 'supesite', 't-site\xe5\xbb\xba\xe7\xab\x99\xe7\xb3\xbb\xe7\xbb\x9f', 'theol\xe7\xbd\x91\xe7\xbb\x9c\xe6\x95\x99\xe5\xad\xa6\xe7\xbb\xbc\xe5\x90\x88\xe5\xb9\xb3\xe5\x8f\xb0', 'trs\xe8\xba\xab\xe4\xbb\xbd\xe8\xae\xa4\xe8\xaf\x81\xe7\xb3\xbb\xe7\xbb\x9f', 'tipask\xe9\x97\xae\xe7\xad\x94\xe7\xb3\xbb\xe7\xbb\x9f', 'tomcat', 'trsids', 'trunkey', 'turbomail\xe9\x82\xae\xe7\xae\xb1\xe7\xb3\xbb\xe7\xbb\x9f', 'v2\xe8\xa7\x86\xe9\xa2\x91\xe4\xbc\x9a\xe8\xae\xae\xe7\xb3\xbb\xe7\xbb\x9f', 'v5shop', 'venshop2010\xe5\x87\xa1\xe4\xba\xba\xe7\xbd\x91\xe7\xbb\x9c\xe8\xb4\xad\xe7\x89\xa9\xe7\xb3\xbb\xe7\xbb\x9f', 'vos3000', 'veryide', 'wcm\xe7\xb3\xbb\xe7\xbb\x9fv6', 'wordpress', 'ws2004\xe6\xa0\xa1\xe5\x9b\xad\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', 'wangzt', 'weblogic', 'webmail', 'weboffice', 'webnet cms', 'webnetcms', 'wilmaroa\xe7\xb3\xbb\xe7\xbb\x9f', 'winmail server', 'winmailserver', 'wizbank', 'xplus\xe6\x8a\xa5\xe7\xa4\xbe\xe7\xb3\xbb\xe7\xbb\x9f', 'xpshop', 'yidacms', 'yongyou', 'z-blog', 'zabbix', 'zoomla', 'abcms', 'able_g2s', 'acsno', 'acsoft', 'actcms', 'adtsec_gateway', 'akcms', 'anleye', 'anmai', 'anmai\xe5\xae\x89\xe8\x84\x89\xe6\x95\x99\xe5\x8a\xa1\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', 'anymacromail', 'apabi_tasi', 'asiastar_sm', 'aten_kvm', 'atripower', 'avcon6', 'axis2', 'ayacms', 'b2cgroup', 'baiaozhi', 'beidou', 'bluecms', 'boblog', 'bocweb', 'bohoog', 'bytevalue_router', 'canon', 'chamilo-lms', 'ckfinder', 'cmseasy', 'cmstop', 'cnoa', 'codeigniter', 'comexe_ras', 'cscms', 'cutecms', 'd-link', 'dahua_dss', 'daiqile_p2p', 'dalianqianhao', 'damall', 'damicms', 'dfe_scada', 'dianyips', 'diguocms\xe5\xb8\x9d\xe5\x9b\xbd', 'dircms', 'dkcms', 'dossm', 'douphp', 'dreamgallery', 'dubbo', 'eshangbao\xe6\x98\x93\xe5\x95\x86\xe5\xae\x9d', 'easethink', 'easy7\xe8\xa7\x86\xe9\xa2\x91\xe7\x9b\x91\xe6\x8e\xa7\xe5\xb9\xb3\xe5\x8f\xb0', 'ecweb_shop', 'edayshop', 'edjoy', 'eduplate', 'edusohocms', 'eims', 'eimscms', 'electric_monitor', 'empire_cms', 'enableq', 'enjie_soft', 'es-cloud', 'esafenet_dlp', 'esccms', 'ewebs', 'expocms', 'extmail', 'eyou', 'e\xe5\x88\x9b\xe7\xab\x99', 'fang5173', 'fangwei', 'fastmeeting', 'fcms', 'fcms\xe6\xa2\xa6\xe6\x83\xb3\xe5\xbb\xba\xe7\xab\x99', 'feifeicms', 'feiyuxing_router', 'finecms', 'fiyocms', 'foosun', 'foosun\xe6\x96\x87\xe7\xab\xa0\xe7\xb3\xbb\xe7\xbb\x9f', 'fsmcms', 'gbcom_wlan', 'genixcms', 'gnuboard', 'gocdkey', 'gooine_sqjz', 'gowinsoft_jw', 'gxcms', 'hac_gateway', 'haitianoa', 'hanweb', 'haohan', 'heeroa', 'hf_firewall', 'hongzhi', 'horde_email', 'house5', 'hsort', 'huachuang_router', 'huanet', 'huashi_tv', 'humhub', 'idvr', 'ipowercms', 'iceflow_vpn_router', 'ideacms', 'ieadcms', 'iflytek_soft', 'igenus', 'ikuai', 'insight', 'jenkins', 'jienuohan', 'jieqicms', 'jindun_gateway', 'jingci_printer', 'jinpan', 'jinqiangui_p2p', 'jishitongxun', 'joomle', 'jumbotcms', 'juniper_vpn', 'kill_firewall', 'kingdee_eas', 'kingdee_oa', 'kinggate', 'kingosoft_xsweb', 'kj65n_monitor', 'klemanndesign', 'kuwebs', 'kxmail', 'landray', 'lebishop', 'lezhixing_datacenter', 'lianbangsoft', 'liangjing', 'libsys', 'linksys', 'looyu_live', 'ltpower', 'luepacific', 'luzhucms', 'lvmaque', 'maccms', 'magento', 'mailgard-webmail', 'mainone_b2b', 'maopoa', 'maxcms', 'mbbcms', 'metinfo', 'mikrotik_router', 'moxa_nport_router', 'mpsec', 'myweb', 'nanjing_shiyou', 'natshell', 'nbcms', 'net110', 'netcore', 'netgather', 'netoray_nsg', 'netpower', 'newvane_onlineexam', 'nitc', 'nitc\xe5\xae\x9a\xe6\xb5\xb7\xe7\xa5\x9e\xe7\x9c\x9f', 'niubicms', 'ns-asg', 'otcms', 'pageadmin', 'panabit', 'phpb2b', 'phpcmsv9', 'phpdisk', 'phpmaps', 'phpmps', 'phpmywind', 'phpshe', 'phpshop', 'phpvibe', 'phpweb', 'phpwiki', 'phpyun', 'piaoyou', 'pkpmbs', 'plc_router', 'powercreator', 'qht_study', 'qianbocms', 'qibosoft', 'qiuxue', 'qizhitong_manager', 'qzdatasoft\xe5\xbc\xba\xe6\x99\xba\xe6\x95\x99\xe5\x8a\xa1\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', 'rockoa', 'rockontrol', 'ruijie_router', 'ruvar_oa', 'ruvarhrm', 's8000', 'santang', 'sdcms', 'seagate_nas', 'seawind', 'seentech_uccenter', 'sgc8000', 'shadows-it', 'shenlan_jiandu', 'shlcms', 'shopnum1', 'shopxp', 'shuangyang_oa', 'siteengine', 'sitefactory', 'skypost', 'skytech', 'smart_oa', 'soffice', 'soullon_edu', 'srun_gateway', 'star-net', 'startbbs', 'strongsoft', 'subeicms', 'syncthru_web_service', 'synjones_school', 'syxxjs', 'sztaiji_zw', 'taocms', 'taodi', 'terramaster', 'thinkox', 'thinkphp', 'thinksns', 'tianbo_train', 'tianrui_lib', 'tipask', 'tongdaoa', 'topsec', 'totalsoft_lib', 'tp-link', 'trs_ids', 'trs_inforadar', 'trs_lunwen', 'trs_wcm', 'typecho', 'umail', 'uniflows', 'unis_gateway', 'uniwin_gov', 'urp', 'v2_conference', 'vbulletin', 'vicworl', 'visionsoft_velcro', 'wangqushop', 'wdcp', 'wdscms', 'weaver_oa', 'websitebaker', 'wecenter', 'weixinpl', 'weway_soft', 'wisedu_elcs', 'workyisystem', 'workyi_system', 'wygxcms', 'xdcms', 'xiaowuyou_cms', 'xikecms', 'xinhaisoft', 'xinyang', 'xinzuobiao', 'xplus', 'xr_gatewayplatform', 'xuezi_ceping', 'xycms', 'ynedut_campus', 'yongyou_a8', 'yongyou_crm', 'yongyou_ehr', 'yongyou_fe', 'yongyou_icc', 'yongyou_nc', 'yongyou_u8', 'yongyou_zhiyuan_a6', 'yuanwei_gateway', 'yxlink', 'zblog', 'zcncms', 'zdsoft_cnet', 'zentao', 'zeroboard', 'zf_cms', 'zfsoft', 'zhongdongli_school', 'zhonghaida_vnet', 'zhongqidonglicms', 'zhongruan_firewall', 'zhoupu', 'zhuangxiu', 'zhuhaigaoling_huanjingzaosheng', 'zmcms', 'zmcms\xe5\xbb\xba\xe7\xab\x99', 'zte', 'zuitu', 'zzcms', '\xe4\xb8\x87\xe4\xbc\x97\xe7\x94\xb5\xe5\xad\x90\xe6\x9c\x9f\xe5\x88\x8acms', '\xe4\xb8\x87\xe5\x8d\x9a\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f2006', '\xe4\xb8\x87\xe5\x8d\x9a\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe4\xb8\x87\xe6\x88\xb7oa', '\xe4\xb8\x87\xe6\xac\xa3\xe9\xab\x98\xe6\xa0\xa1\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe4\xb8\x89\xe6\x89\x8d\xe6\x9c\x9f\xe5\x88\x8a\xe7\xb3\xbb\xe7\xbb\x9f', '\xe4\xb8\xad\xe4\xbc\x81\xe5\x8a\xa8\xe5\x8a\x9bcms', '\xe4\xb9\x90\xe5\xbd\xbc\xe5\xa4\x9a\xe7\xbd\x91\xe5\xba\x97', '\xe4\xba\xbf\xe9\x82\xaeemail', '\xe4\xbc\x81\xe6\x99\xba\xe9\x80\x9a\xe7\xb3\xbb\xe5\x88\x97\xe4\xb8\x8a\xe7\xbd\x91\xe8\xa1\x8c\xe4\xb8\xba\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe4\xbc\x97\xe6\x8b\x93', '\xe5\x85\xa8\xe7\xa8\x8boa', '\xe5\x87\xa1\xe8\xaf\xba\xe4\xbc\x81\xe4\xb8\x9a\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\x88\x86\xe7\xb1\xbb\xe4\xbf\xa1\xe6\x81\xaf\xe7\xbd\x91bank.asp\xe5\x90\x8e\xe9\x97\xa8', '\xe5\x88\x9b\xe6\x8d\xb7\xe9\xa9\xbe\xe6\xa0\xa1\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\x8d\x8e\xe5\xa4\x8f\xe5\x88\x9b\xe6\x96\xb0appex\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\x8d\x97\xe6\x96\xb9\xe6\x95\xb0\xe6\x8d\xae', '\xe5\x8f\xa3\xe7\xa6\x8f\xe7\xa7\x91\xe6\x8a\x80', '\xe5\x91\xb3\xe5\xa4\x9a\xe7\xbe\x8e\xe5\xaf\xbc\xe8\x88\xaa', '\xe5\x95\x86\xe5\xa5\x87cms', '\xe5\x95\x86\xe5\xae\xb6\xe4\xbf\xa1\xe6\x81\xaf\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\x9b\x9b\xe9\x80\x9a\xe6\x94\xbf\xe5\xba\x9c\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\xa4\xa7\xe6\xb1\x89jcms', '\xe5\xa4\xa9\xe6\x9f\x8f\xe5\x9c\xa8\xe7\xba\xbf\xe8\x80\x83\xe8\xaf\x95\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\xa4\xa9\xe8\x9e\x8d\xe4\xbf\xa1panabit', '\xe5\xae\x81\xe5\xbf\x97\xe5\xad\xa6\xe6\xa0\xa1\xe7\xbd\x91\xe7\xab\x99', '\xe5\xae\x81\xe5\xbf\x97\xe5\xad\xa6\xe6\xa0\xa1\xe7\xbd\x91\xe7\xab\x99\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\xae\x89\xe4\xb9\x90\xe4\xb8\x9a\xe6\x88\xbf\xe4\xba\xa7\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\xae\x9a\xe6\xb5\xb7\xe7\xa5\x9e\xe7\x9c\x9f', '\xe5\xb0\x8f\xe8\xae\xa1\xe5\xa4\xa9\xe7\xa9\xba\xe8\xbf\x9b\xe9\x94\x80\xe5\xad\x98\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\xb0\x98\xe6\x9c\x88\xe4\xbc\x81\xe4\xb8\x9a\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\xb0\x98\xe7\xbc\x98\xe9\x9b\x85\xe5\xa2\x83\xe5\x9b\xbe\xe6\x96\x87\xe7\xb3\xbb\xe7\xbb\x9f', '\xe5\xbb\xba\xe7\xab\x99\xe4\xb9\x8b\xe6\x98\x9f', '\xe5\xbe\xae\xe6\x93\x8e\xe7\xa7\x91\xe6\x8a\x80', '\xe6\x82\x9f\xe7\xa9\xbacrm', '\xe6\x82\x9f\xe7\xa9\xbacrm\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x93\x8e\xe5\xa4\xa9\xe6\x94\xbf\xe5\x8a\xa1\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x96\xb0\xe4\xb8\xba\xe8\xbd\xaf\xe4\xbb\xb6e-learning\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x96\xb0\xe7\xa7\x80', '\xe6\x96\xb9\xe7\xbb\xb4\xe5\x9b\xa2\xe8\xb4\xad', '\xe6\x96\xb9\xe7\xbb\xb4\xe5\x9b\xa2\xe8\xb4\xad\xe8\xb4\xad\xe7\x89\xa9\xe5\x88\x86\xe4\xba\xab\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x97\xb6\xe4\xbb\xa3\xe4\xbc\x81\xe4\xb8\x9a\xe9\x82\xae', '\xe6\x98\x8e\xe8\x85\xbecms', '\xe6\x98\x93\xe5\x88\x9b\xe6\x80\x9d', '\xe6\x98\x93\xe5\x88\x9b\xe6\x80\x9d\xe6\x95\x99\xe8\x82\xb2\xe5\xbb\xba\xe7\xab\x99\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x98\x93\xe6\x83\xb3cms', '\xe6\x99\xba\xe7\x9d\xbf\xe7\xbd\x91\xe7\xab\x99\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x9c\x80\xe5\x9c\x9f\xe5\x9b\xa2\xe8\xb4\xad\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x9c\xaa\xe7\x9f\xa5oem\xe5\xae\x89\xe9\x98\xb2\xe7\x9b\x91\xe6\x8e\xa7\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x9c\xaa\xe7\x9f\xa5\xe6\x94\xbf\xe5\xba\x9c\xe9\x87\x87\xe8\xb4\xad\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x9c\xaa\xe7\x9f\xa5\xe6\x9f\xa5\xe8\xaf\xa2\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\x9d\xad\xe5\xb7\x9e\xe5\x8d\x9a\xe9\x87\x87cms', '\xe6\x9d\xb0\xe5\xa5\x87\xe5\xb0\x8f\xe8\xaf\xb4\xe8\xbf\x9e\xe8\xbd\xbd\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\xa1\x83\xe6\xba\x90\xe7\x9b\xb8\xe5\x86\x8c\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\xb1\x87\xe6\x88\x90\xe4\xbc\x81\xe4\xb8\x9a\xe5\xbb\xba\xe7\xab\x99cms', '\xe6\xb1\x87\xe6\x96\x87\xe5\x9b\xbe\xe4\xb9\xa6\xe9\xa6\x86\xe4\xb9\xa6\xe7\x9b\xae\xe6\xa3\x80\xe7\xb4\xa2\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\xb1\x89\xe7\xa0\x81\xe9\xab\x98\xe6\xa0\xa1\xe6\xaf\x95\xe4\xb8\x9a\xe7\x94\x9f\xe5\xb0\xb1\xe4\xb8\x9a\xe4\xbf\xa1\xe6\x81\xaf\xe7\xb3\xbb\xe7\xbb\x9f', '\xe6\xb3\x9b\xe5\xbe\xaee-office', '\xe6\xb3\x9b\xe5\xbe\xaeoa', '\xe6\xb5\xaa\xe6\xbd\xaecms', '\xe6\xb5\xb7\xe5\xba\xb7\xe5\xa8\x81\xe8\xa7\x86', '\xe7\x88\xb1\xe6\xb7\x98\xe5\xae\xa2', '\xe7\x88\xb1\xe8\xa3\x85\xe7\xbd\x91', '\xe7\x94\xa8\xe5\x8f\x8bfe\xe5\x8d\x8f\xe4\xbd\x9c\xe5\x8a\x9e\xe5\x85\xac\xe5\xb9\xb3\xe5\x8f\xb0', '\xe7\x94\xa8\xe5\x8f\x8bfe\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe7\x94\xa8\xe5\x8f\x8bturbcrm\xe7\xb3\xbb\xe7\xbb\x9f', '\xe7\x94\xa8\xe5\x8f\x8bu8', '\xe7\x94\xa8\xe5\x8f\x8b', '\xe7\x9a\x93\xe7\xbf\xb0\xe9\x80\x9a\xe7\x94\xa8\xe6\x95\xb0\xe5\xad\x97\xe5\x8c\x96\xe6\xa0\xa1\xe5\x9b\xad\xe5\xb9\xb3\xe5\x8f\xb0', '\xe7\x9c\x81\xe7\xba\xa7\xe5\x86\x9c\xe6\x9c\xba\xe6\x9e\x84\xe7\xbd\xae\xe8\xa1\xa5\xe8\xb4\xb4\xe4\xbf\xa1\xe6\x81\xaf\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe7\xa7\x91\xe4\xbf\xa1\xe9\x82\xae\xe4\xbb\xb6\xe7\xb3\xbb\xe7\xbb\x9f', '\xe7\xa7\x91\xe8\xbf\x88ras', '\xe7\xa8\x8b\xe6\xb0\x8f\xe8\x88\x9e\xe6\x9b\xb2cms', '\xe7\xbb\xbf\xe9\xba\xbb\xe9\x9b\x80\xe5\x80\x9f\xe8\xb4\xb7\xe7\xb3\xbb\xe7\xbb\x9f', '\xe7\xbd\x91\xe8\xb6\xa3\xe5\x95\x86\xe5\x9f\x8e', '\xe7\xbd\x91\xe9\x92\x9b\xe6\x96\x87\xe7\xab\xa0\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe8\x80\x81y\xe6\x96\x87\xe7\xab\xa0\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe8\x81\x94\xe4\xbc\x97mediinfo\xe5\x8c\xbb\xe9\x99\xa2\xe7\xbb\xbc\xe5\x90\x88\xe7\xae\xa1\xe7\x90\x86\xe5\xb9\xb3\xe5\x8f\xb0', '\xe8\x87\xaa\xe5\x8a\xa8\xe5\x8f\x91\xe5\x8d\xa1\xe5\xb9\xb3\xe5\x8f\xb0', '\xe8\x89\xaf\xe7\xb2\xbe\xe5\x8d\x97\xe6\x96\xb9', '\xe8\x89\xba\xe5\xb8\x86cms', '\xe8\x8f\xb2\xe6\x96\xaf\xe7\x89\xb9\xe8\xaf\xba\xe6\x9c\x9f\xe5\x88\x8a\xe7\xb3\xbb\xe7\xbb\x9f', '\xe8\x93\x9d\xe5\x87\x8ceis\xe6\x99\xba\xe6\x85\xa7\xe5\x8d\x8f\xe5\x90\x8c\xe5\xb9\xb3\xe5\x8f\xb0', '\xe8\x93\x9d\xe7\xa7\x91cms', '\xe8\x96\x84\xe5\x86\xb0\xe6\x97\xb6\xe6\x9c\x9f\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe8\xae\xaf\xe6\x97\xb6\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9fcms', '\xe8\xae\xb0\xe4\xba\x8b\xe7\x8b\x97', '\xe8\xb4\xb7\xe9\xbd\x90\xe4\xb9\x90\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x80\x9a\xe8\xbe\xbeoa\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x80\x9f\xe8\xb4\x9dcms', '\xe9\x87\x91\xe8\x89\xb2\xe6\xa0\xa1\xe5\x9b\xad', '\xe9\x87\x91\xe8\x9d\xb6oa', '\xe9\x87\x91\xe8\x9d\xb6\xe5\x8d\x8f\xe4\xbd\x9c\xe5\x8a\x9e\xe5\x85\xac\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x87\x91\xe9\x92\xb1\xe6\x9f\x9cp2p', '\xe9\x9b\x86\xe6\x97\xb6\xe9\x80\x9a\xe8\xae\xaf\xe7\xa8\x8b\xe5\xba\x8f', '\xe9\x9c\xb2\xe7\x8f\xa0\xe6\x96\x87\xe7\xab\xa0\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x9d\x92\xe4\xba\x91\xe5\xae\xa2cms', '\xe9\x9d\x92\xe5\xb3\xb0\xe7\xbd\x91\xe7\xbb\x9c\xe6\x99\xba\xe8\x83\xbd\xe7\xbd\x91\xe7\xab\x99\xe7\xae\xa1\xe7\x90\x86\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x9d\x92\xe6\x9e\x9c\xe5\xad\xa6\xe7\x94\x9f\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x9d\x92\xe6\x9e\x9c\xe5\xad\xa6\xe7\x94\x9f\xe7\xbb\xbc\xe5\x90\x88\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x9d\x92\xe6\x9e\x9c\xe6\x95\x99\xe5\x8a\xa1\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x9d\x92\xe6\x9e\x9c\xe8\xbd\xaf\xe4\xbb\xb6\xe6\x95\x99\xe5\x8a\xa1\xe7\xb3\xbb\xe7\xbb\x9f', '\xe9\x9d\x9e\xe5\x87\xa1\xe5\xbb\xba\xe7\xab\x99']
 
+class ProductIndex(object):
+    '''
+    产品名归一化索引: 小写、去分隔符、别名归并、拆分版本号
+    用于多引擎结果合并去重，以及按集合查找判断是否为cms
+    '''
+    # 版本号可以带一个字母前缀，如 Discuz! X3.4、phpcms V9
+    version_re = re.compile(r'^(.+?)[\s/]+v?([a-z]?\d[\w.-]*)$', re.I)
+    version_suffix_re = re.compile(r'^v?[a-z]?\d[\w.-]*$')
+    separator_re = re.compile(r'[\s_\-!]+')
+    aliases = {
+        'phpcmsv9': 'phpcms',
+        'edusohocms': 'edusoho',
+        'kessioncms': 'kesioncms',
+        'joomle': 'joomla',
+        'shopnum1': 'shopnum',
+        'eimscms': 'eims',
+    }
+
+    def __init__(self, names=()):
+        self.names = set()
+        for name in names:
+            self.names.add(self.normalize(ProductIndex.decode_name(name))[0])
+
+    @staticmethod
+    def decode_name(name):
+        # cms_finger_list中的中文名是py2遗留的utf-8字节串
+        try:
+            return name.encode('latin-1').decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            return name
+
+    def normalize(self, name):
+        '''返回 (归一化名称, 版本号)'''
+        name = str(name).strip().lower()
+        version = ''
+        match = self.version_re.match(name)
+        if match:
+            name, version = match.group(1), match.group(2)
+        key = self.separator_re.sub('', name)
+        return self.aliases.get(key, key), version
+
+    def __contains__(self, name):
+        return self.normalize(name)[0] in self.names
+
+    def merge(self, banner):
+        '''
+        按归一化名称合并，同一产品优先保留带版本号的写法
+        名称之间没有分隔符的版本号(如 Discuz 与 DiscuzX3.4)按前缀归并：较长的名称以较短的名称开头且剩余部分是版本号
+
+        >>> product_index.merge(['Discuz', 'Discuz! X3.4'])
+        ['Discuz! X3.4']
+        >>> product_index.merge(['Discuz', 'discuz7.2'])
+        ['discuz7.2']
+        >>> product_index.merge(['nginx', 'Nginx/1.18.0', 'jQuery'])
+        ['Nginx/1.18.0', 'jQuery']
+        >>> product_index.merge(['PHP', 'phpMyAdmin'])
+        ['PHP', 'phpMyAdmin']
+        '''
+        merged = {}
+        names = {}
+        for x in sorted(set(banner)):
+            if x:
+                names[x] = self.normalize(x)
+        # 短名称先加入，较长的名称才能找到它的前缀
+        for x, (key, version) in sorted(names.items(), key=lambda item: (len(item[1][0]), item[0])):
+            for prefix in merged:
+                rest = key[len(prefix):]
+                if prefix and key.startswith(prefix) and self.version_suffix_re.match(rest):
+                    key, version = prefix, version or rest
+                    break
+            if key not in merged or (version and not merged[key][1]):
+                merged[key] = (x, version)
+        return [merged[key][0] for key in sorted(merged, key=lambda key: merged[key][0])]
+
+
+product_index = ProductIndex(cms_finger_list)
+
 def requests_proxies():
     '''
     Proxies for every requests
@@ -108,105 +242,137 @@ def count():
             return row[0]
 
 
+def parse_fofa_condition(rule):
+    """单个条件 title="x" / body="x" / header="x" 解析为 (字段, 字面量)，无法解析时返回None"""
+    try:
+        if 'title="' in rule:
+            return 'title', re.findall(rtitle, rule)[0].lower()
+        elif 'body="' in rule:
+            return 'body', re.findall(rbody, rule)[0]
+        else:
+            return 'header', re.findall(rheader, rule)[0]
+    except IndexError:
+        return None
+
+
+def parse_fofa_key(key):
+    """
+    把规则表达式预先解析为 (模式, 条件组)，匹配时不再切分字符串和执行正则
+    any: 任一条件组全部满足即命中; all: 每个条件组都至少满足一个才命中
+    """
+    # 满足一个条件即可的情况
+    if '||' in key and '&&' not in key and '(' not in key:
+        return 'any', [[parse_fofa_condition(rule)] for rule in key.split('||')]
+    # 只有一个条件的情况
+    elif '||' not in key and '&&' not in key and '(' not in key:
+        return 'any', [[parse_fofa_condition(key)]]
+    # 需要同时满足条件的情况
+    elif '&&' in key and '||' not in key and '(' not in key:
+        return 'any', [[parse_fofa_condition(rule) for rule in key.split('&&')]]
+    bracket = re.findall(rbracket, key)
+    if not bracket:
+        return 'any', []
+    # 与条件下存在并条件: 1||2||(3&&4)
+    if '&&' in bracket[0]:
+        return 'any', [[parse_fofa_condition(_rule) for _rule in rule.split('&&')] for rule in key.split('||')]
+    # 并条件下存在与条件： 1&&2&&(3||4)
+    return 'all', [[parse_fofa_condition(_rule) for _rule in rule.split('||')] for rule in key.split('&&')]
+
+
+def match_fofa(expression, fields):
+    """fields为 {'header', 'body', 'title'(已转小写)}"""
+    mode, groups = expression
+    if mode == 'any':
+        return any(all(cond and cond[1] in fields[cond[0]] for cond in group) for group in groups)
+    return all(any(cond and cond[1] in fields[cond[0]] for cond in group) for group in groups)
+
+
+_fofa_rules = None
+_fofa_rules_lock = threading.Lock()
+
+
+def fofa_rules():
+    """tide表的全部规则，一次读出并预先解析，进程内只读一次数据库"""
+    global _fofa_rules
+    with _fofa_rules_lock:
+        if _fofa_rules is None:
+            with sqlite3.connect(pwd + '/cms_finger.db') as conn:
+                rows = conn.execute('SELECT id, name, keys FROM `tide` ORDER BY id').fetchall()
+            _fofa_rules = [(_id, name, parse_fofa_key(key)) for _id, name, key in rows]
+        return _fofa_rules
+
+
 class Cmsscanner(object):
-    def __init__(self, target):
+    def __init__(self, target, timings=None, profiler=None, session=None, config=None, cache=None):
         self.target = target
         self.start = time.time()
         self.finger = []
+        self.timings = timings or Timings()
+        self.profiler = profiler
+        self.session = session
+        self.config = config or ScanConfig()
+        self.cache = cache
+
+    def fetch(self):
+        return httpclient.fetch(self.target, self.timings, 'main', session=self.session, headers=agent,
+                                timeout=self.config.timeout, verify=False)
 
     def get_info(self):
         """获取web的信息"""
         try:
-            r = requests.get(url=self.target, headers=agent,
-                             timeout=request_timeout, verify=False)
-            content = r.text
+            return self.parse(self.fetch())
+        except Exception as e:
+            pass
+
+    def parse(self, r):
+        """从响应中取出header、body和title"""
+        from bs4 import BeautifulSoup as BS
+        content = r.text
+        with self.timings.stage('fofa_parse'):
             try:
                 title = BS(content, 'lxml').title.text.strip()
                 return str(r.headers), content, title.strip('\n')
             except:
                 return str(r.headers), content, ''
-        except Exception as e:
-            pass
 
-    def check_rule(self, key, header, body, title):
-        """指纹识别"""
-        try:
-            if 'title="' in key:
-                if re.findall(rtitle, key)[0].lower() in title.lower():
-                    return True
-            elif 'body="' in key:
-                if re.findall(rbody, key)[0] in body: return True
-            else:
-                if re.findall(rheader, key)[0] in header: return True
-        except Exception as e:
-            pass
-
-    def handle(self, _id, header, body, title):
-        """取出数据库的key进行匹配"""
-        name, key = check(_id)
-        # 满足一个条件即可的情况
-        if '||' in key and '&&' not in key and '(' not in key:
-            for rule in key.split('||'):
-                if self.check_rule(rule, header, body, title):
-                    self.finger.append(name)
-                    # print '%s[+] %s   %s%s' % (G, self.target, name, W)
-                    break
-        # 只有一个条件的情况
-        elif '||' not in key and '&&' not in key and '(' not in key:
-            if self.check_rule(key, header, body, title):
-                self.finger.append(name)
-                # print '%s[+] %s   %s%s' % (G, self.target, name, W)
-        # 需要同时满足条件的情况
-        elif '&&' in key and '||' not in key and '(' not in key:
-            num = 0
-            for rule in key.split('&&'):
-                if self.check_rule(rule, header, body, title):
-                    num += 1
-            if num == len(key.split('&&')):
+    def handle(self, _id, name, expression, fields):
+        """对单条规则进行匹配"""
+        if self.profiler is None:
+            if match_fofa(expression, fields):
                 self.finger.append(name)
-                # print '%s[+] %s   %s%s' % (G, self.target, name, W)
-        else:
-            # 与条件下存在并条件: 1||2||(3&&4)
-            if '&&' in re.findall(rbracket, key)[0]:
-                for rule in key.split('||'):
-                    if '&&' in rule:
-                        num = 0
-                        for _rule in rule.split('&&'):
-                            if self.check_rule(_rule, header, body, title):
-                                num += 1
-                        if num == len(rule.split('&&')):
-                            self.finger.append(name)
-                            # print '%s[+] %s   %s%s' % (G, self.target, name, W)
-                            break
-                    else:
-                        if self.check_rule(rule, header, body, title):
-                            self.finger.append(name)
-                            # print '%s[+] %s   %s%s' % (G, self.target, name, W)
-                            break
-            else:
-                # 并条件下存在与条件： 1&&2&&(3||4)
-                for rule in key.split('&&'):
-                    num = 0
-                    if '||' in rule:
-                        for _rule in rule.split('||'):
-                            if self.check_rule(_rule, title, body, header):
-                                num += 1
-                                break
-                    else:
-                        if self.check_rule(rule, title, body, header):
-                            num += 1
-                if num == len(key.split('&&')):
-                    self.finger.append(name)
-                    # print '%s[+] %s   %s%s' % (G, self.target, name, W)
+            return
+        start = time.perf_counter()
+        hit = match_fofa(expression, fields)
+        self.profiler.record('fofa', '%s:%s' % (_id, name), time.perf_counter() - start, hit)
+        if hit:
+            self.finger.append(name)
+
+    def match(self, header, body, title):
+        """遍历全部规则进行匹配"""
+        with self.timings.stage('fofa_match'):
+            fields = {'header': header, 'body': body, 'title': title.lower()}
+            for _id, name, expression in fofa_rules():
+                self.handle(_id, name, expression, fields)
+        return self.finger
+
+    def match_response(self, r):
+        """匹配响应，结果缓存中有相同响应的结果时直接复用"""
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.cache.response_digest(r))
+            finger = self.cache.get('fofa', key)
+            if finger is not None:
+                self.finger = finger
+                self.timings.add_cached('fofa')
+                return self.finger
+        self.match(*self.parse(r))
+        if key is not None:
+            self.cache.put('fofa', key, self.finger)
+        return self.finger
 
     def run(self):
         try:
-            header, body, title = self.get_info()
-            for _id in range(1, int(count()),1):
-                try:
-                    self.handle(_id, header, body, title)
-                except Exception as e:
-                    pass
+            self.match_response(self.fetch())
         except Exception as e:
             print(e)
         finally:
@@ -214,7 +380,9 @@ class Cmsscanner(object):
 
 def getMD5(c):
     md5 = hashlib.md5()
-    md5.update(ip.encode('utf-8'))
+    if isinstance(c, str):
+        c = c.encode('utf-8')
+    md5.update(c)
     return md5.hexdigest()
 
 
@@ -264,41 +432,133 @@ class WorkManager:  # 线程池管理,创建
     def get_result(self, *args, **kwds):
         return self.resultQueue.get(*args, **kwds)
 
+class CmsMd5Index(object):
+    '''
+    cms表的内存索引，按路径聚合: md5指纹为 {path: {md5: row}}，关键字/正则指纹为 {path: [(row, needles)]}
+    每个路径只需请求一次，md5指纹通过字典直接命中
+    关键字预先转小写并按常见编码转成字节，直接在原始响应字节中查找，只有正则指纹才需要解码页面
+    '''
+    KEYWORD_CHARSETS = ('utf-8', 'gb18030')
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, rows):
+        self.md5 = {}
+        self.patterns = {}
+        self.paths = []
+        for row in rows:
+            path, match_pattern, options = row[2], row[3], row[4]
+            if path not in self.md5 and path not in self.patterns:
+                self.paths.append(path)
+            if options == 'md5':
+                self.md5.setdefault(path, {}).setdefault(match_pattern.lower(), row)
+            elif options == 'keyword':
+                self.patterns.setdefault(path, []).append((row, self.needles(match_pattern)))
+            elif options == 'regx':
+                self.patterns.setdefault(path, []).append((row, None))
+
+    @classmethod
+    def needles(cls, keyword):
+        '''
+        关键字在各编码下的小写字节形式
+        响应字节用bytes.lower()只转换ASCII字母，关键字编码后同样再转换一次，双字节编码的尾字节两边保持一致
+        '''
+        keyword = keyword.lower()
+        result = []
+        for charset in cls.KEYWORD_CHARSETS:
+            try:
+                needle = keyword.encode(charset).lower()
+            except UnicodeError:
+                continue
+            if needle not in result:
+                result.append(needle)
+        return tuple(result)
+
+    @classmethod
+    def install(cls, file_path, index):
+        with cls._cache_lock:
+            cls._cache[os.path.abspath(file_path)] = index
+
+    @classmethod
+    def load(cls, file_path):
+        '''同一个指纹库只建立一次索引'''
+        key = os.path.abspath(file_path)
+        with cls._cache_lock:
+            index = cls._cache.get(key)
+            if index is None:
+                sqlconn = sqlite3.connect(file_path)
+                sqlcursor = sqlconn.cursor()
+                sqlcursor.execute('select * from cms order by hit')
+                index = cls(sqlcursor.fetchall())
+                sqlcursor.close()
+                sqlconn.close()
+                cls._cache[key] = index
+            return index
+
+    def match(self, path, response):
+        '''
+        返回命中的指纹行，未命中返回None
+        关键字在小写后的原始响应字节中查找，只在遇到正则指纹时才读取response.text解码页面
+        '''
+        content = response.content
+        if not content:
+            return None
+        md5_rows = self.md5.get(path)
+        if md5_rows:
+            row = md5_rows.get(getMD5(content))
+            if row:
+                return row
+        lowered = None
+        for row, needles in self.patterns.get(path, ()):
+            if needles is not None:
+                if lowered is None:
+                    lowered = content.lower()
+                for needle in needles:
+                    if needle in lowered:
+                        return row
+            elif re.search(row[3], response.text):
+                return row
+        return None
+
+
 class WhatCms:
-    def __init__(self,target,file_path):
+    def __init__(self,target,file_path,timings=None,session=None,config=None):
         self.cms=[]
         self.diction={}
         self.is_finish=False
         self.g_index=0
         self.threads=[]
         self.lock=threading.Lock()
-        self.thread_num = check_thunder
+        self.config = config or ScanConfig()
+        self.thread_num = self.config.check_thunder
         self.target=WhatCms.normalize_target(target)
         self.info={}
         self.file_path=file_path
+        self.index=None
+        self.timings=timings
+        self.session=session
 
     @staticmethod
-    def request_url(url):
+    def request(url, timings=None, kind='probe', session=None, config=None):
+        '''状态码为200时返回响应，否则返回None；不读取response.text，页面在用到时才解码'''
+        config = config or ScanConfig()
         try:
-            if use_proxy:
-                proxy = random.choice(proxy_list)
-                web_proxy = {"http": proxy.replace("\n","")}
-                print("web_proxy",web_proxy)
-            else:
-                web_proxy = {"http":''}
-
-            headers={
-                'User-Agent':'Mozilla/5.0 (Windows NT 10.0; WOW64; rv:59.0) Gecko/20100101 Firefox/59.0'
-            }
-
-            r = requests.get(url=url, headers=requests_headers(),timeout=request_timeout,verify=False,proxies = web_proxy)
-            r.encoding = 'utf-8'
+            # 代理由session的代理池选择(见ScanConfig.new_proxy_pool)
+            r = httpclient.fetch(url, timings, kind, session, headers=requests_headers(),timeout=config.timeout,verify=False)
             if r.status_code==200:
-                return r.text,r.content
-            else:
-                return '',''
+                return r
+        except hostguard.CircuitOpen:
+            raise
         except Exception as e:
-            return '',''
+            pass
+        return None
+
+    @staticmethod
+    def request_url(url, timings=None, kind='probe', session=None, config=None):
+        r = WhatCms.request(url, timings, kind, session, config)
+        if r is not None:
+            return r.text,r.content
+        return '',''
 
     @staticmethod
     def normalize_target(target):
@@ -315,7 +575,7 @@ class WhatCms:
         根据powered by获取cms
         :return:
         '''
-        html,content = WhatCms.request_url(self.target)
+        html,content = WhatCms.request_url(self.target, config=self.config)
         match = re.search('Powered by (.*)', html, re.I)
         if match:
             clear_html_cms = re.sub('<.*?>', '', match.group(1))
@@ -352,50 +612,30 @@ class WhatCms:
             self.g_index += 1
             self.lock.release()
 
-            finger_id,cms_name,path,match_pattern,options,hit = eachline[0],eachline[1],eachline[2],eachline[3],eachline[4],eachline[5]
-
+            path = eachline
             url = self.target + path
             # print self.g_index,url
-            response_html,response_content = WhatCms.request_url(url)
-
-            if options == "md5":
-                if match_pattern == getMD5(response_content):
-                    self.lock.acquire()
-                    self.is_finish = True
-                    self.info['finger_id']= finger_id
-                    self.info['cms_name']=cms_name
-                    self.info['path'] = path
-                    self.info['match_pattern']=match_pattern
-                    self.info['options']=options
-                    self.info['hit']=hit
-                    self.lock.release()
-                    break
-
-            elif options == "keyword":
-                if match_pattern.lower() in response_html.lower():
-                    self.lock.acquire()
-                    self.is_finish = True
-                    self.info['finger_id']= finger_id
-                    self.info['cms_name']=cms_name
-                    self.info['path'] = path
-                    self.info['match_pattern']=match_pattern
-                    self.info['options']=options
-                    self.info['hit']=hit
-                    self.lock.release()
-                    break
-            elif options == "regx":
-                r = re.search(match_pattern, response_html)
-                if r:
-                    self.lock.acquire()
-                    self.is_finish = True
-                    self.info['finger_id']= finger_id
-                    self.info['cms_name']=cms_name
-                    self.info['path'] = path
-                    self.info['match_pattern']=match_pattern
-                    self.info['options']=options
-                    self.info['hit']=hit
-                    self.lock.release()
-                    break
+            try:
+                response = WhatCms.request(url, self.timings, session=self.session, config=self.config)
+            except hostguard.CircuitOpen:
+                # 目标已连续多次请求失败，放弃剩余的探测路径
+                with self.lock:
+                    self.g_index = len(self.cms)
+                continue
+
+            row = self.index.match(path, response) if response is not None else None
+            if row:
+                finger_id,cms_name,path,match_pattern,options,hit = row[0],row[1],row[2],row[3],row[4],row[5]
+                self.lock.acquire()
+                self.is_finish = True
+                self.info['finger_id']= finger_id
+                self.info['cms_name']=cms_name
+                self.info['path'] = path
+                self.info['match_pattern']=match_pattern
+                self.info['options']=options
+                self.info['hit']=hit
+                self.lock.release()
+                break
 
     def start_threads(self):
 
@@ -410,13 +650,8 @@ class WhatCms:
         # info=self.find_powered_by()
         info = False
         if not info:
-            sqlconn1=sqlite3.connect(self.file_path)
-            sqlcursor1=sqlconn1.cursor()
-            sqlcursor1.execute('select * from cms order by hit')
-            self.cms = sqlcursor1.fetchall()
-            # print self.cms[1]
-            sqlcursor1.close()
-            sqlconn1.close()
+            self.index = CmsMd5Index.load(self.file_path)
+            self.cms = self.index.paths
             self.start_threads()
 
     def get_result(self):
@@ -428,7 +663,7 @@ class WhatCms:
                         lock.acquire()
                         sqlconn=sqlite3.connect(self.file_path)
                         sqlcursor=sqlconn.cursor()
-                        sqlcursor.execute('update cms set hit =? where finger_id = ?',(self.info['hit']+1,self.info['finger_id']))
+                        sqlcursor.execute('update cms set hit = hit + 1 where finger_id = ?',(self.info['finger_id'],))
                         sqlcursor.close()
                         sqlconn.commit()
                         sqlconn.close()
@@ -439,36 +674,443 @@ class WhatCms:
             else:
                 return False
 
-def finger_query(url):
-    whatcms=WhatCms(url,'cms_finger.db')
+def finger_query(url, timings=None, session=None, config=None):
+    whatcms=WhatCms(url,'cms_finger.db',timings,session,config)
     whatcms.run()
     finger_dic = whatcms.get_result()
     return finger_dic
 
-def useWappalyzer(url):
+def useWappalyzer(url, timings=None, profiler=None, session=None, config=None, cache=None):
+    timings = timings or Timings()
+    config = config or ScanConfig()
     try:
-        wappalyzer = Wappalyzer.latest()
-        webpage = WebPage.new_from_url(url)
-        webprints = wappalyzer.analyze(webpage)
-        if len(webprints) > 0:
-            return list(webprints)
-        else:
-            return {}
+        with timings.stage('wappalyzer_load'):
+            wappalyzer = new_wappalyzer()
+        wappalyzer.profiler = profiler
+        response = httpclient.fetch(url, timings, 'wappalyzer', session,
+                                    timeout=config.timeout, verify=False)
+        return match_wappalyzer(wappalyzer, response, timings, cache)
     except Exception as e:
         print(e)
 
 
+def match_wappalyzer(wappalyzer, response, timings, cache=None):
+    """
+    对响应运行Wappalyzer，返回识别结果明细
+    结果缓存的键包含url规则命中的产品，url规则是唯一与页面内容无关的输入
+    """
+    from Wappalyzer import WebPage
+    key = None
+    if cache is not None:
+        key = cache.key(cache.response_digest(response), wappalyzer.url_matches(response.url))
+        detail = cache.get('wappalyzer', key)
+        if detail is not None:
+            timings.add_cached('wappalyzer')
+            return detail
+    with timings.stage('wappalyzer_parse'):
+        webpage = WebPage.new_from_response(response)
+    with timings.stage('wappalyzer_match'):
+        webprints = wappalyzer.analyze(webpage)
+    detail = wappalyzer_detail(wappalyzer, webprints)
+    if key is not None:
+        cache.put('wappalyzer', key, detail)
+    return detail
+
+
+_wappalyzer_template = None
+_wappalyzer_lock = threading.Lock()
+
+
+def new_wappalyzer():
+    """
+    规则在进程内只加载一次(有规则快照时直接使用快照)，每个目标使用共享规则的新实例
+    正则在第一次使用时编译，编译结果在各实例间共享
+    """
+    global _wappalyzer_template
+    from Wappalyzer import Wappalyzer
+    with _wappalyzer_lock:
+        if _wappalyzer_template is None:
+            if rules_snapshot:
+                data = rules_snapshot['wappalyzer']
+                _wappalyzer_template = Wappalyzer(data['categories'], data['technologies'], prepared=True)
+            else:
+                _wappalyzer_template = Wappalyzer.latest()
+        template = _wappalyzer_template
+    return Wappalyzer(template.categories, template.technologies, prepared=True)
+
+
+def wappalyzer_regex_stats():
+    """已加载的Wappalyzer规则中正则总数和已编译数，未加载时返回None"""
+    template = _wappalyzer_template
+    return template.regex_stats() if template else None
+
+
+def wappalyzer_detail(wappalyzer, webprints):
+    return [{'name': x,
+             'versions': wappalyzer.get_versions(x),
+             'confidence': wappalyzer.get_confidence(x)} for x in sorted(webprints)]
+
+
+rules_snapshot = None
+
+
+def load_snapshot(verbose=False):
+    """
+    当前目录下存在规则快照(snapshot.py生成)时从快照加载三个引擎的规则，
+    快照不存在或已失效时返回False，各引擎照常从规则源加载
+    """
+    global rules_snapshot, _fofa_rules, _wappalyzer_template
+    import snapshot
+    from webanalyzer import webanalyzer
+    path, db_path, rule_dir = snapshot.default_paths()
+    try:
+        data = snapshot.load(path, db_path, rule_dir)
+    except snapshot.SnapshotError as e:
+        if verbose:
+            print(e)
+        return False
+    if data is None:
+        return False
+    with _fofa_rules_lock:
+        _fofa_rules = data['fofa']
+    CmsMd5Index.install(db_path, CmsMd5Index(data['cms_rows']))
+    webanalyzer.WebAnalyzer.install_rules(**data['webanalyzer'])
+    rules_snapshot = data
+    with _wappalyzer_lock:
+        _wappalyzer_template = None
+    return True
+
+
+def merge_banner(banner):
+    return product_index.merge(banner)
+
+
+def pick_cms(banner):
+    """
+    banner中最后一个属于cms库的产品作为识别结果，没有时返回空字符串
+    带版本号的写法按去掉版本号后的名称判断
+
+    >>> pick_cms(['PHP 7.4', 'WordPress 5.8'])
+    'WordPress 5.8'
+    >>> pick_cms(['Discuz! X3.4', 'nginx'])
+    'Discuz! X3.4'
+    >>> pick_cms(['ASP.NET', 'IIS 10.0'])
+    ''
+    """
+    cms_name = ''
+    for banner_tmp2 in banner:
+        if banner_tmp2 in product_index:
+            cms_name = banner_tmp2
+    return cms_name
+
+
+# 指纹引擎按开销从低到高排列：fofa只做字符串查找，Wappalyzer需要解析页面并执行正则，
+# webanalyzer还要额外请求图标。stop_on_cms模式按此顺序执行，识别出cms后跳过其余引擎
+ENGINES = ('fofa', 'wappalyzer', 'webanalyzer')
+
+
+def parse_engines(value):
+    """解析逗号分隔的引擎列表，按开销从低到高的顺序返回"""
+    names = set(x.strip().lower() for x in value.split(',') if x.strip())
+    unknown = names - set(ENGINES)
+    if unknown or not names:
+        raise ValueError("未知的指纹引擎: %s，可选: %s" % (','.join(sorted(unknown)), ','.join(ENGINES)))
+    return tuple(x for x in ENGINES if x in names)
+
+
+_rules_loaded = set()
+_rules_lock = threading.Lock()
+
+
+def load_rules(engines=ENGINES, verbose=False):
+    """
+    加载指定引擎的规则，每个进程只加载一次，有规则快照时直接使用快照
+    未预先加载时webanalyzer每个目标都会重新读取规则目录
+    """
+    with _rules_lock:
+        if not _rules_loaded and rules_snapshot is None:
+            load_snapshot(verbose)
+        for engine in engines:
+            if engine in _rules_loaded:
+                continue
+            if engine == 'fofa':
+                fofa_rules()
+            elif engine == 'wappalyzer':
+                new_wappalyzer()
+            elif engine == 'webanalyzer' and rules_snapshot is None:
+                from webanalyzer import webanalyzer
+                webanalyzer._new_analyzer().reload_rules()
+            _rules_loaded.add(engine)
+
+
+def run_engine(engine, target_url, engines, timings, profiler=None, session=None, config=None, cache=None):
+    """运行单个指纹引擎，结果写入engines，返回识别出的产品名列表；cache为跨目标的结果缓存(resultcache.ResultCache)"""
+    if engine == 'fofa':
+        cms = Cmsscanner(target_url, timings, profiler, session, config, cache)
+        fofa_finger = cms.run()
+        engines['fofa'] = [{'name': x} for x in fofa_finger]
+        return list(fofa_finger)
+
+    banner = []
+    if engine == 'wappalyzer':
+        try:
+            wappalyzer_finger = useWappalyzer(target_url, timings, profiler, session, config, cache)
+            # print("Wappalyzer:",Wappalyzer)
+            engines['wappalyzer'] = wappalyzer_finger
+
+            for x in wappalyzer_finger:
+                x = str(x['name']).replace('\\;confidence:50','')
+                # print(x)
+                banner.append(x)
+        except Exception as e:
+            print("Wappalyzer check error:",e)
+            pass
+
+    elif engine == 'webanalyzer':
+        from webanalyzer import webanalyzer
+        try:
+            webanalyzer_session = httpclient.TimedSession(timings, 'webanalyzer', session)
+            webanalyzer_result = webanalyzer.analyze(target_url, webanalyzer_session, timings, profiler,
+                                                     reload='webanalyzer' not in _rules_loaded, timeout=config.timeout,
+                                                     cache=cache)
+            engines['webanalyzer'] = webanalyzer_result
+            for webanalyzer_banner_ in webanalyzer.banner(webanalyzer_result):
+                banner.append(webanalyzer_banner_)
+        except Exception as e:
+            print("Webanalyzer check error:",e)
+            pass
+    return banner
+
+
+def scan_target(target_url, dir_mode=0, profiler=None, session=None, engines=ENGINES, stop_on_cms=False,
+                config=None, cache=None):
+    '''
+    依次调用各指纹引擎识别单个目标，返回结构化结果
+    engines指定参与识别的引擎，stop_on_cms为True时识别出cms即跳过后面开销更大的引擎
+    config为ScanConfig，不指定时使用模块级的默认配置
+    cache为跨目标的结果缓存，响应与之前的目标完全相同时直接复用引擎结果，结果中cached列出复用了结果的引擎
+    '''
+    config = config or ScanConfig()
+    start = time.time()
+    timings = Timings()
+    result = {'url': target_url, 'cms': 'Not Found', 'banner': [], 'engines': {}}
+    banner = []
+
+    for engine in ENGINES:
+        if engine not in engines:
+            continue
+        with timings.stage(engine):
+            banner.extend(run_engine(engine, target_url, result['engines'], timings, profiler, session, config,
+                                     cache))
+        if stop_on_cms and pick_cms(merge_banner(banner)):
+            break
+
+    with timings.stage('merge'):
+        banner = merge_banner(banner)
+    result['banner'] = banner
+
+    cms_name = pick_cms(banner)
+    if not cms_name:
+        if dir_mode == 1:
+            with timings.stage('dir'):
+                cms_name_tmp = finger_query(target_url, timings, session, config)
+            result['engines']['dir'] = cms_name_tmp or {}
+            if cms_name_tmp:
+                cms_name = cms_name_tmp['cms_name']
+    if cms_name:
+        result['cms'] = cms_name
+    result['truncated'] = list(timings.truncated)
+    result['cached'] = list(timings.cached)
+    result['timings'] = timings.to_dict()
+    result['elapsed'] = round(time.time() - start, 3)
+    return result
+
+
+def is_target(url):
+    return bool(re.match(r'^https?:/{2}\w.+$', url))
+
+
+class Scanner(object):
+    '''
+    供其他程序直接调用的扫描器，规则在创建时加载一次，配置、会话和线程池保存在实例中，可以反复调用
+
+        scanner = Scanner(engines=('fofa', 'wappalyzer'), request_timeout=10)
+        result = scanner.scan('http://www.example.com')
+        results = scanner.scan_many(urls, callback=print)
+        result = await scanner.scan_async('http://www.example.com')
+
+    结果格式与scan_target一致；processes大于0时scan_many使用流水线模式(见pipeline.py)
+    resolve为True时scan_many先并发解析全部目标的域名，无法解析的目标不扫描，记录在unresolved中
+    dedup为True时各目标共用结果缓存，响应完全相同的目标直接复用引擎结果(流水线模式下每个工作进程各有一份缓存)
+    result_store为持久化的结果存储(如指定了rules的ResponseArchive)，结果缓存同时读写其中的结果，流水线模式下不使用
+    其余关键字参数(request_timeout、connect_timeout、check_thunder、proxy_list、body_limits、rate_limits、retries、
+    failure_threshold)用于创建ScanConfig
+    未指定session时创建keep-alive连接池，每个主机的连接数与目录探测线程数一致，按rate_limits限速，按主机熔断和重试
+    '''
+    def __init__(self, engines=ENGINES, stop_on_cms=False, dir_mode=0, workers=20, processes=0,
+                 session=None, profiler=None, config=None, resolve=False, dedup=True,
+                 result_store=None, **options):
+        self.engines = tuple(x for x in ENGINES if x in engines)
+        self.stop_on_cms = stop_on_cms
+        self.dir_mode = dir_mode
+        self.workers = workers
+        self.processes = processes
+        self.resolve = resolve
+        self.unresolved = []
+        self.dedup = dedup
+        self.cache = None
+        if dedup:
+            import resultcache
+            self.cache = resultcache.ResultCache(store=result_store)
+        self.profiler = profiler
+        self.config = config or ScanConfig(**options)
+        self._own_session = session is None
+        if session is None:
+            session = httpclient.PooledSession(max(httpclient.POOL_HOSTS, workers),
+                                               max(self.config.check_thunder, 1),
+                                               body_limits=self.config.body_limits,
+                                               limiter=self.config.new_limiter(),
+                                               guard=self.config.new_guard(),
+                                               proxy_pool=self.config.new_proxy_pool())
+        self.session = session
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        load_rules(self.engines)
+
+    @staticmethod
+    def check_targets(urls):
+        urls = list(urls)
+        for url in urls:
+            if not is_target(url):
+                raise ValueError("URL地址错误: %s" % url)
+        return urls
+
+    def scan(self, url):
+        """识别单个目标"""
+        self.check_targets([url])
+        return scan_target(url, self.dir_mode, self.profiler, self.session, self.engines, self.stop_on_cms,
+                           self.config, self.cache)
+
+    def resolve_targets(self, urls):
+        """预先并发解析目标的域名，返回可以解析的目标，无法解析的追加到unresolved"""
+        urls, failed = httpclient.resolve_targets(urls, max(self.workers, 50))
+        self.unresolved.extend(failed)
+        return urls
+
+    def scan_many(self, urls, callback=None):
+        """并发识别多个目标，结果按完成顺序交给callback，返回全部结果"""
+        urls = self.check_targets(urls)
+        if self.resolve:
+            urls = self.resolve_targets(urls)
+        if self.processes:
+            import pipeline
+            # 流水线的抓取线程和工作进程通过import TideFinger读取本模块
+            sys.modules.setdefault('TideFinger', sys.modules[__name__])
+            return pipeline.run(urls, self.processes, self.workers, self.dir_mode, self.session, callback,
+                                self.engines, self.stop_on_cms, self.config, self.dedup)
+
+        from concurrent.futures import as_completed
+        results = []
+        for future in as_completed([self.executor().submit(self.scan, url) for url in urls]):
+            result = future.result()
+            results.append(result)
+            if callback:
+                callback(result)
+        return results
+
+    async def scan_async(self, url):
+        """scan的协程版本，在实例的线程池中执行"""
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(self.executor(), self.scan, url)
+
+    async def scan_many_async(self, urls):
+        """scan_many的协程版本，结果与urls顺序一致"""
+        import asyncio
+        urls = self.check_targets(urls)
+        return list(await asyncio.gather(*[self.scan_async(url) for url in urls]))
+
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.workers)
+            return self._executor
+
+    def pool_stats(self):
+        """连接复用统计，session不是PooledSession时返回None"""
+        stats = getattr(self.session, 'stats', None)
+        return stats() if stats else None
+
+    def rate_stats(self):
+        """限速统计，未限速时返回None"""
+        limiter = getattr(self.session, 'limiter', None)
+        return limiter.stats() if limiter else None
+
+    def cache_stats(self):
+        """结果缓存各引擎的命中率，只统计非流水线模式，未启用时返回None"""
+        return self.cache.stats() if self.cache else None
+
+    def guard_stats(self):
+        """重试和熔断统计，session不是PooledSession时返回None"""
+        guard = getattr(self.session, 'guard', None)
+        return guard.stats() if guard else None
+
+    def proxy_stats(self):
+        """代理池统计，未使用代理时返回None"""
+        proxy_pool = getattr(self.session, 'proxy_pool', None)
+        return proxy_pool.stats() if proxy_pool else None
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        if self._own_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def print_result(result):
+    banner_all = ''
+    for banner_tmp2 in result['banner']:
+        banner_all= banner_all + ' | '+banner_tmp2
+    banner_all = banner_all.strip()
+    if banner_all.startswith('| '):
+        banner_all = banner_all[1:]
+    if banner_all:
+        print(R,"Banner:",W,G,banner_all,W)
+    print(R,"CMS_finger:",W,G,result['cms'],W)
+
+
 # exit(0)
 
 if __name__ == "__main__":
     # log = open('log.txt','a+')
     msg = '''
-    Usage: python3 TideFinger.py -u http://www.123.com [-p 1] [-m 50] [-t 5] [-d 1] 
+    Usage: python3 TideFinger.py -u http://www.123.com [-f url.txt] [-o result.jsonl] [-T 1] [-P profile.json] [-a archive.db] [-R archive.db] [-i archive.db] [-w 4] [-e fofa,wappalyzer] [-s 1] [-L 2048,1024,256] [-r 10,20,200] [-p 1] [-m 50] [-n 1] [-t 5] [-d 1] 
     
     -u: 待检测目标URL地址
-    -p: 指定该选项为1后，说明启用代理检测，请确保代理文件名为proxys_ips.txt,每行一条代理，格式如: 124.225.223.101:80
+    -f: 批量检测，从文件中读取目标URL，每行一个，响应完全相同的目标(如停放域名、同模板站点)直接复用识别结果
+    -o: 以JSON Lines格式输出结果，每个目标完成后写入一行，已存在的文件会被覆盖，指定为 - 时输出到标准输出
+    -T: 指定为1时，扫描结束后输出各阶段耗时直方图；指定为文件名时同时把直方图和各项统计以JSON格式写入该文件
+    -P: 启用规则耗时统计，扫描结束后输出耗时最多的规则，并把全部规则的统计写入指定的JSON文件
+    -a: 把扫描过程中的全部响应保存到指定的归档文件，指纹库更新后可以用-R回放
+    -R: 回放模式，从归档文件读取响应重新识别，不发起网络请求，未指定-u/-f时回放归档中的全部目标
+    -i: 增量扫描，同-a保存响应，并保存识别结果；再次扫描时按归档中的ETag/Last-Modified发送条件请求，返回304时复用归档中的响应和识别结果
+    -w: 流水线模式，抓取与指纹匹配分离，匹配由指定数量的进程并行执行，适合大批量目标，0为不启用，默认为不启用
+    -e: 参与识别的指纹引擎，逗号分隔，可选fofa、wappalyzer、webanalyzer，默认全部启用
+    -s: 指定为1时按开销从低到高(fofa、wappalyzer、webanalyzer)依次识别，识别出cms后跳过其余引擎，默认为不启用
+    -L: 响应体大小上限(KB)，逗号分隔依次为主页面、目录探测、图标，超过后截断，默认为2048,1024,256
+    -r: 限速(每秒请求数)，逗号分隔依次为每个主机、每个IP、全局，0为不限；启用后目标返回429/503或超时时自动降速，默认为不限速
+    -p: 指定该选项为1后，全部请求(http和https)通过代理发送，请确保代理文件名为proxys_ips.txt,每行一条代理，格式如: 124.225.223.101:80；失败过多的代理自动剔除，冷却后重新试用，每个代理最多同时10个请求
     -m: 指纹匹配的线程数，不指定时默认为50
-    -t: 网站响应超时时间，默认为5秒
+    -n: 指定为1时扫描前先并发解析全部目标的域名，跳过无法解析的目标，默认为不启用
+    -t: 网站响应超时时间，默认为5秒，也可以逗号分隔依次指定连接超时和读取超时，如3,10；连续失败的目标自动熔断，超时会按实际响应时间收紧
     -d: 是否启用目录匹配式指纹探测（会对目标站点发起大量请求），0为不启用，1为启用，默认为不启用。
     '''
     if len(sys.argv) < 2:
@@ -478,22 +1120,71 @@ if __name__ == "__main__":
             use_proxy = False
             check_thunder = 50
             request_timeout = 5
+            connect_timeout = None
             dir_mode = 0
-            options,args = getopt.getopt(sys.argv[1:],"u:p:m:t:d:")
+            options,args = getopt.getopt(sys.argv[1:],"u:f:o:T:P:a:R:i:w:e:s:L:r:p:m:n:t:d:")
             ip = ''
             m_count = 100
             target_url=''
+            url_file = ''
+            output_file = ''
+            show_histogram = False
+            stats_file = ''
+            profile_file = ''
+            archive_file = ''
+            replay_file = ''
+            incremental = False
+            processes = 0
+            engines = ENGINES
+            stop_on_cms = False
+            body_limits = {}
+            rate_limits = ()
+            pre_resolve = False
             ping = True
             for opt,arg in options:
                 if opt == '-u':
                     target_url = arg
+                elif opt == '-f':
+                    url_file = arg
+                elif opt == '-o':
+                    output_file = arg
+                elif opt == '-T':
+                    show_histogram = arg not in ('', '0')
+                    # 指定为文件名时还把统计写入该文件，不与-o的逐目标结果混在一起
+                    stats_file = arg if arg not in ('', '0', '1') else ''
+                elif opt == '-P':
+                    profile_file = arg
+                elif opt == '-a':
+                    archive_file = arg
+                elif opt == '-R':
+                    replay_file = arg
+                elif opt == '-i':
+                    archive_file = arg
+                    incremental = True
+                elif opt == '-w':
+                    processes = int(arg)
+                elif opt == '-e':
+                    engines = parse_engines(arg)
+                elif opt == '-s':
+                    stop_on_cms = arg == '1'
+                elif opt == '-L':
+                    for body_type, size in zip(('main', 'probe', 'favicon'), arg.split(',')):
+                        if size.strip():
+                            body_limits[body_type] = int(size) * 1024
+                elif opt == '-r':
+                    rate_limits = tuple(float(x) if x.strip() else 0 for x in arg.split(','))
                 elif opt == '-p':
                     if arg == '1':
                         use_proxy = True
                 elif opt == '-m':
                     check_thunder = int(arg)
+                elif opt == '-n':
+                    pre_resolve = arg == '1'
                 elif opt == '-t':
-                    request_timeout = int(arg)
+                    timeouts = [float(x) for x in arg.split(',')]
+                    request_timeout = timeouts[-1]
+                    if len(timeouts) > 1:
+                        connect_timeout = timeouts[0]
                 elif opt == '-d':
                     dir_mode = int(arg)
 
@@ -507,81 +1198,138 @@ if __name__ == "__main__":
                 else:
                     print("读取代理列表出错，请确保代理文件名为proxys_ips.txt,每行一条代理，格式如: 124.225.223.101:80")
 
-            if re.match(r'^https?:/{2}\w.+$', target_url):
-                print('\n')
-                print("Current Task: ",target_url)
-                cms = Cmsscanner(target_url)
-                fofa_finger = cms.run()
-                banner = []
-                for x in fofa_finger:
-                    banner.append(x)
-                try:
-                    Wappalyzer = useWappalyzer(target_url)
-                    # print("Wappalyzer:",Wappalyzer)
-
-                    for x in Wappalyzer:
-                        x = str(x).replace('\\;confidence:50','')
-                        # print(x)
-                        banner.append(x)
-                except Exception as e:
-                    print("Wappalyzer check error:",e)
-                    pass
-
-                try:
-                    update = False
-                    webanalyzer_banner = webanalyzer.check(target_url,update)
-                    for webanalyzer_banner_ in webanalyzer_banner:
-                        banner.append(webanalyzer_banner_)
-                except Exception as e:
-                    print("Webanalyzer check error:",e)
-                    pass
-                print("-"*50)
-
-                banner_tmp = []
-                # print("banner:",banner)
-                banner.sort()
-                banner_ = set(list(banner))
-                # print("banner_:",banner_)
-
-                for x in banner_:
-                    if x:
-                        flag = 0
-                        for y in banner_tmp:
-                            if str(x).lower() in str(y).lower() or str(y).lower() in str(x):
-                                flag = 1
-                                continue
-                        if flag == 0:
-                            banner_tmp.append(x)
-
-                banner = banner_tmp
-
-                banner_all = ''
-                cms_name = ''
-                cms_name_flag = 0
-                for banner_tmp2 in banner:
-                    banner_all= banner_all + ' | '+banner_tmp2
-                    if banner_tmp2.lower() in cms_finger_list:
-                        cms_name = banner_tmp2
-                        cms_name_flag = 1
-                banner_all = banner_all.strip()
-                if banner_all.startswith('| '):
-                    banner_all = banner_all[1:]
-                if banner_all:
-                    print(R,"Banner:",W,G,banner_all,W)
-
-                if not cms_name_flag:
-                    if dir_mode == 1:
-                        cms_name_tmp = finger_query(target_url)
-                        if cms_name_tmp:
-                            cms_name = cms_name_tmp['cms_name']
-                if not cms_name:
-                    cms_name = 'Not Found'
-                print(R,"CMS_finger:",W,G,cms_name,W)
-                end =datetime.datetime.now()
+            targets = []
+            if target_url:
+                targets.append(target_url)
+            if url_file:
+                for url_tmp in open(url_file):
+                    if url_tmp.strip():
+                        targets.append(url_tmp.strip())
+
+            pool = None
+            archive = None
+            config = ScanConfig(request_timeout, check_thunder, proxy_list if use_proxy else [], body_limits, rate_limits,
+                                connect_timeout)
+            if replay_file:
+                archive = ResponseArchive(replay_file)
+                session = ArchiveSession(archive)
+                if not targets:
+                    targets = archive.targets()
+            else:
+                pool = httpclient.PooledSession(pool_per_host=max(check_thunder, 1), body_limits=body_limits,
+                                                limiter=config.new_limiter(), guard=config.new_guard(),
+                                                proxy_pool=config.new_proxy_pool())
+                session = pool
+                if incremental:
+                    archive = ResponseArchive(archive_file, rules_version())
+                    session = RevalidatingSession(archive, pool)
+                elif archive_file:
+                    archive = ResponseArchive(archive_file)
+                    session = RecordingSession(archive, pool)
+
+            load_rules(engines, verbose=True)
+            histogram = Histogram()
+            profiler = RuleProfiler() if profile_file else None
+            writer = None
+            if output_file:
+                writer = JsonlWriter(output_file)
+                if output_file == '-':
+                    # 标准输出只保留JSON Lines，其余提示信息输出到stderr
+                    sys.stdout = sys.stderr
+
+            # 各引擎复用相同响应结果的次数，流水线模式下缓存在工作进程中，只能从结果汇总
+            cache_hits = {}
+
+            def report(result):
+                if archive and not replay_file:
+                    archive.add_target(result['url'])
                 print("-"*50)
-                print("Time Used:",(end - start).seconds,'秒')
+                print_result(result)
+                histogram.add(result['timings'])
+                for engine in result.get('cached', ()):
+                    cache_hits[engine] = cache_hits.get(engine, 0) + 1
+                if writer:
+                    writer.write(result)
+
+            valid_targets = []
+            for target_url in targets:
+                if is_target(target_url):
+                    valid_targets.append(target_url)
+                else:
+                    print("URL地址错误")
+
+            if pre_resolve and not replay_file:
+                valid_targets, unresolved = httpclient.resolve_targets(valid_targets)
+                for target_url in unresolved:
+                    print("域名解析失败:", target_url)
+
+            if processes and profiler:
+                print("流水线模式不支持规则耗时统计，已忽略-P")
+            if processes and incremental:
+                print("流水线模式下增量扫描只复用未变化的响应，识别结果不保存")
+            scanner = Scanner(engines, stop_on_cms, dir_mode, processes=processes, session=session,
+                              profiler=profiler, config=config, result_store=archive if incremental else None)
+            if processes:
+                def pipeline_report(result):
+                    print('\n')
+                    print("Current Task: ",result['url'])
+                    report(result)
+                scanner.scan_many(valid_targets, callback=pipeline_report)
             else:
-                print("URL地址错误")
+                for target_url in valid_targets:
+                    print('\n')
+                    print("Current Task: ",target_url)
+                    report(scanner.scan(target_url))
+            end =datetime.datetime.now()
+            print("-"*50)
+            if show_histogram:
+                print(histogram.report())
+                regex_stats = wappalyzer_regex_stats()
+                if regex_stats:
+                    print("Wappalyzer正则: 共%d条，已编译%d条" % (regex_stats['patterns'], regex_stats['compiled']))
+                pool_stats = pool.stats() if pool else None
+                if pool_stats:
+                    print("连接复用: 请求%d次，新建连接%d个，复用率%.1f%%" % (
+                        pool_stats['requests'], pool_stats['connections'], pool_stats['reuse_rate'] * 100))
+                rate_stats = pool.limiter.stats() if pool and pool.limiter else None
+                if rate_stats:
+                    print("限速: 等待%d次共%.1f秒，退避%d次，仍在退避的主机%d个" % (
+                        rate_stats['waited'], rate_stats['wait_seconds'], rate_stats['throttled'], rate_stats['backing_off']))
+                dns_stats = httpclient.dns_cache.stats() if pool else None
+                if dns_stats:
+                    print("DNS缓存: 查询%d次，命中%d次，解析成功%d个、失败%d个" % (
+                        dns_stats['lookups'], dns_stats['hits'], dns_stats['resolved'], dns_stats['failed']))
+                guard_stats = pool.guard.stats() if pool and pool.guard else None
+                if guard_stats:
+                    print("重试%d次，熔断%d个主机，熔断后跳过请求%d个" % (
+                        guard_stats['retries'], guard_stats['opened'], guard_stats['rejected']))
+                proxy_stats = pool.proxy_pool.stats() if pool and pool.proxy_pool else None
+                if proxy_stats:
+                    print("代理: 可用%d/%d个，剔除%d次，恢复%d次，无可用代理跳过请求%d个" % (
+                        proxy_stats['healthy'], proxy_stats['proxies'], proxy_stats['evicted'],
+                        proxy_stats['readmitted'], proxy_stats['rejected']))
+                if cache_hits:
+                    print("结果复用: " + "，".join("%s %d次" % item for item in sorted(cache_hits.items())))
+                print("-"*50)
+                if stats_file:
+                    with open(stats_file, 'w', encoding='utf-8') as fd:
+                        json.dump({'histogram': histogram.to_dict(), 'wappalyzer_regex': regex_stats,
+                                   'connections': pool_stats, 'rate_limit': rate_stats, 'guard': guard_stats,
+                                   'dns': dns_stats, 'cache_hits': cache_hits, 'proxy': proxy_stats},
+                                  fd, ensure_ascii=False, indent=1, default=str)
+            if writer:
+                writer.close()
+            if archive:
+                print("Archive:", archive.stats())
+                if incremental:
+                    revalidated = session.stats()
+                    print("增量扫描: 条件请求%d次，未变化%d次" % (revalidated['conditional'], revalidated['not_modified']))
+                archive.close()
+            if profiler:
+                print(profiler.report())
+                print("-"*50)
+                profiler.dump(profile_file)
+            print("Time Used:",(end - start).seconds,'秒')
 
         except Exception as e:
             print(str(time.strftime('%Y-%m-%d %X', time.localtime(time.time())))+"  Info  "+str(e))
@@ -1,19 +1,23 @@
-import aiohttp
 from typing import Callable, Dict, Iterable, List, Mapping, Any, Set
 import json
 import logging
-import pkg_resources
 import re
 import os
+import time
 import pathlib
 import requests
+from lazyregex import LazyRegex
 from datetime import datetime, timedelta
 
 from bs4 import BeautifulSoup # type: ignore
-from typing import Union, Optional
+from typing import Union, Optional, Tuple
 
 logger = logging.getLogger(name="python-Wappalyzer")
 
+# Shipped next to this module. Read directly instead of through ``pkg_resources``,
+# which is slow to import; ``aiohttp`` is likewise only imported by the async helpers.
+TECHNOLOGIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "technologies.json")
+
 
 class WappalyzerError(Exception):
     """
@@ -108,7 +112,7 @@ class WebPage:
 
     @classmethod
     async def new_from_url_async(cls, url: str, verify: bool = True,
-                                 aiohttp_client_session: aiohttp.ClientSession = None, **kwargs:Any) -> 'WebPage':
+                                 aiohttp_client_session: 'aiohttp.ClientSession' = None, **kwargs:Any) -> 'WebPage':
         """
         Same as new_from_url only Async.
 
@@ -131,6 +135,7 @@ class WebPage:
 
         """
 
+        import aiohttp
         if not aiohttp_client_session:
             connector = aiohttp.TCPConnector(ssl=verify)
             aiohttp_client_session = aiohttp.ClientSession(connector=connector)
@@ -139,7 +144,7 @@ class WebPage:
             return await cls.new_from_response_async(response)
 
     @classmethod
-    async def new_from_response_async(cls, response:aiohttp.ClientResponse) -> 'WebPage':
+    async def new_from_response_async(cls, response:'aiohttp.ClientResponse') -> 'WebPage':
         """
         Constructs a new WebPage object for the response,
         using the `BeautifulSoup` module to parse the HTML.
@@ -187,7 +192,7 @@ class Wappalyzer:
 
     """
 
-    def __init__(self, categories:Dict[str, Any], technologies:Dict[str, Any]):
+    def __init__(self, categories:Dict[str, Any], technologies:Dict[str, Any], prepared:bool=False):
         """
         Manually initialize a new Wappalyzer instance. 
         
@@ -195,11 +200,20 @@ class Wappalyzer:
 
         :param categories: Map of category ids to names, as in ``technologies.json``.
         :param technologies: Map of technology names to technology dicts, as in ``technologies.json``.
+        :param prepared: The technologies were already normalized by `_prepare_technology`
+            (e.g. loaded from a rule snapshot). They are shallow copied so detection state
+            stays per instance while the patterns are shared.
         """
         self.categories = categories
-        self.technologies = technologies
         self._confidence_regexp = re.compile(r"(.+)\\;confidence:(\d+)")
+        # Optional per technology profiler, see `analyze`
+        self.profiler = None
+
+        if prepared:
+            self.technologies = {name: dict(technology) for name, technology in technologies.items()}
+            return
 
+        self.technologies = technologies
         # TODO
         for name, technology in list(self.technologies.items()):
             self._prepare_technology(technology)
@@ -224,9 +238,6 @@ class Wappalyzer:
             from `AliasIO/wappalyzer <https://github.com/AliasIO/wappalyzer>`_ repository.  
         
         """
-        default=pkg_resources.resource_string(__name__, "technologies.json")
-        defaultobj = json.loads(default)
-
         if technologies_file:
             with open(technologies_file, 'r', encoding='utf-8') as fd:
                 obj = json.load(fd)
@@ -251,14 +262,14 @@ class Wappalyzer:
                         create = True
                         ).pop())
 
-                    if obj != defaultobj:
+                    if obj != cls._load_default():
                         with _technologies_file.open('w', encoding='utf-8') as tfile:
                             tfile.write(lastest_technologies_file.text)
                         logger.info("python-Wappalyzer technologies.json file updated")
 
                 except Exception as err: # Or loads default
                     logger.error("Could not download latest Wappalyzer technologies.json file because of error : '{}'. Using default. ".format(err))
-                    obj = defaultobj
+                    obj = cls._load_default()
             else:
                 logger.debug("python-Wappalyzer technologies.json file not updated because already updated in the last 24h")
                 with _technologies_file.open('r', encoding='utf-8') as tfile:
@@ -266,11 +277,19 @@ class Wappalyzer:
 
             logger.info("Using technologies.json file at {}".format(_technologies_file.as_posix()))
         else:
-            obj = defaultobj
+            obj = cls._load_default()
 
         
         return cls(categories=obj['categories'], technologies=obj['technologies'])
 
+    @staticmethod
+    def _load_default() -> Dict[str, Any]:
+        """
+        Load the ``technologies.json`` file shipped with the module.
+        """
+        with open(TECHNOLOGIES_FILE, 'r', encoding='utf-8') as fd:
+            return json.load(fd)
+
     @staticmethod
     def _find_files(
         env_location: List[str],
@@ -352,10 +371,34 @@ class Wappalyzer:
             for name, pattern in list(obj.items()):
                 obj[name] = self._prepare_pattern(obj[name])
 
+    @staticmethod
+    def iter_patterns(technology: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+        """
+        Iterate over all prepared patterns of a technology.
+        """
+        for key in ['url', 'html', 'scripts']:
+            yield from technology[key]
+        for key in ['headers', 'meta']:
+            for patterns in technology[key].values():
+                yield from patterns
+
+    def regex_stats(self) -> Dict[str, int]:
+        """
+        Number of prepared patterns and how many of them have been compiled so far.
+        """
+        total = compiled = 0
+        for technology in self.technologies.values():
+            for pattern in self.iter_patterns(technology):
+                total += 1
+                if pattern['regex'].compiled:
+                    compiled += 1
+        return {'patterns': total, 'compiled': compiled}
+
     def _prepare_pattern(self, pattern:Union[str, List[str]]) -> List[Dict[str, Any]]:
         """
-        Strip out key:value pairs from the pattern and compile the regular
-        expression.
+        Strip out key:value pairs from the pattern and prepare the regular
+        expression. Most patterns are never exercised for a given page (the header or
+        meta key they need is absent), so they are compiled on first use.
         """
         prep_patterns = []
         if isinstance(pattern, list):
@@ -367,17 +410,9 @@ class Wappalyzer:
             for index, expression in enumerate(patterns):
                 if index == 0:
                     attrs['string'] = expression
-                    try:
-                        attrs['regex'] = re.compile(expression, re.I) # type: ignore
-                    except re.error as err:
-                        # Wappalyzer is a JavaScript application therefore some of the regex wont compile in Python.
-                        logger.debug(
-                            "Caught '{error}' compiling regex: {regex}".format(
-                                error=err, regex=patterns)
-                        )
-                        # regex that never matches:
-                        # http://stackoverflow.com/a/1845097/413622
-                        attrs['regex'] = re.compile(r'(?!x)x') # type: ignore
+                    # Wappalyzer is a JavaScript application therefore some of the regex wont compile in Python,
+                    # LazyRegex turns those into a regex that never matches.
+                    attrs['regex'] = LazyRegex(expression, re.I)
                 else:
                     attr = expression.split(':')
                     if len(attr) > 1:
@@ -387,6 +422,14 @@ class Wappalyzer:
 
         return prep_patterns
 
+    def url_matches(self, url:str) -> Tuple[str, ...]:
+        """
+        Names of the technologies whose url patterns match. This is the only part of
+        a detection that depends on the URL rather than the page itself.
+        """
+        return tuple(name for name, technology in self.technologies.items()
+                     if any(pattern['regex'].search(url) for pattern in technology['url']))
+
     def _has_technology(self, technology: Dict[str, Any], webpage: WebPage) -> bool:
         """
         Determine whether the web page matches the technology signature.
@@ -457,7 +500,7 @@ class Wappalyzer:
 
         # Dectect version number
         if 'version' in pattern:
-            allmatches = re.findall(pattern['regex'], value)
+            allmatches = pattern['regex'].findall(value)
             for i, matches in enumerate(allmatches):
                 version = pattern['version']
 
@@ -556,16 +599,33 @@ class Wappalyzer:
         """
         return None if 'confidenceTotal' not in self.technologies[app_name] else self.technologies[app_name]['confidenceTotal']
 
+    def _reset_detection(self) -> None:
+        """
+        Drop the detection state left by a previous page, so one instance can be reused.
+        """
+        for technology in self.technologies.values():
+            for key in ('detected', 'confidence', 'confidenceTotal', 'versions'):
+                technology.pop(key, None)
+
     def analyze(self, webpage:WebPage) -> Set[str]:
         """
         Return a set of technology that can be detected on the web page.
 
         :param webpage: The Webpage to analyze
         """
+        self._reset_detection()
         detected_technologies = set()
 
         for tech_name, technology in list(self.technologies.items()):
-            if self._has_technology(technology, webpage):
+            if self.profiler is None:
+                if self._has_technology(technology, webpage):
+                    detected_technologies.add(tech_name)
+                continue
+
+            start = time.perf_counter()
+            has_tech = self._has_technology(technology, webpage)
+            self.profiler.record('wappalyzer', tech_name, time.perf_counter() - start, has_tech)
+            if has_tech:
                 detected_technologies.add(tech_name)
 
         detected_technologies.update(self._get_implied_technologies(detected_technologies))
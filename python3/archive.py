@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json,time,zlib,sqlite3,hashlib,threading
+
+import httpclient
+
+
+class ResponseArchive(object):
+    '''
+    响应归档，保存扫描过程中的全部响应(主页面、favicon、子页面、目录探测)
+    响应体按sha1去重后zlib压缩存储，规则更新后可以直接回放重新识别
+    rules为当前规则的版本(见rules_version)，指定后归档同时保存各引擎的识别结果(见resultcache.ResultCache)，
+    其他版本规则的结果在打开时删除
+    识别结果只包含名称、版本等基本类型，以JSON保存，回放他人的归档文件不会执行其中的数据
+    '''
+    commit_every = 200
+
+    def __init__(self, path, rules=None):
+        self.path = path
+        self.rules = rules
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS targets (url TEXT PRIMARY KEY, scanned_at REAL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, final_url TEXT, '
+                          'status INTEGER, headers TEXT, body_hash TEXT, fetched_at REAL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS bodies (hash TEXT PRIMARY KEY, data BLOB)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results (engine TEXT, key BLOB, rules TEXT, value BLOB, '
+                          'PRIMARY KEY (engine, key))')
+        if rules is not None:
+            self.conn.execute('DELETE FROM results WHERE rules != ?', (rules,))
+        self.conn.commit()
+
+    def _commit(self, force=False):
+        self.pending += 1
+        if force or self.pending >= self.commit_every:
+            self.conn.commit()
+            self.pending = 0
+
+    def add_target(self, url):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO targets VALUES (?, ?)', (url, time.time()))
+            self._commit(force=True)
+
+    def targets(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute('SELECT url FROM targets ORDER BY scanned_at')]
+
+    def put(self, url, response):
+        content = response.content or b''
+        body_hash = hashlib.sha1(content).hexdigest()
+        headers = json.dumps(dict(response.headers), ensure_ascii=False)
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO bodies VALUES (?, ?)', (body_hash, zlib.compress(content, 6)))
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                              (url, response.url, response.status_code, headers, body_hash, time.time()))
+            self._commit()
+
+    def get(self, url):
+        with self.lock:
+            row = self.conn.execute('SELECT r.final_url, r.status, r.headers, b.data FROM responses r '
+                                    'JOIN bodies b ON r.body_hash = b.hash WHERE r.url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        final_url, status, headers, data = row
+        return httpclient.make_response(final_url or url, status, json.loads(headers), zlib.decompress(data))
+
+    def validators(self, url):
+        '''保存的响应中的 (ETag, Last-Modified)，没有保存该url时返回None'''
+        with self.lock:
+            row = self.conn.execute('SELECT headers FROM responses WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        headers = {k.lower(): v for k, v in json.loads(row[0]).items()}
+        return headers.get('etag'), headers.get('last-modified')
+
+    def get_result(self, engine, key):
+        if self.rules is None:
+            return None
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM results WHERE engine = ? AND key = ? AND rules = ?',
+                                    (engine, key, self.rules)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            # 早期版本以pickle保存的结果，不再读取
+            return None
+
+    def put_result(self, engine, key, value):
+        if self.rules is None:
+            return
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                              (engine, key, self.rules, json.dumps(value, ensure_ascii=False)))
+            self._commit()
+
+    def stats(self):
+        with self.lock:
+            responses = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            bodies, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM bodies').fetchone()
+            results = self.conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return {'responses': responses, 'bodies': bodies, 'compressed_bytes': size, 'results': results}
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class RecordingSession(object):
+    '''请求真实站点，同时把响应写入归档'''
+    def __init__(self, archive, session=None):
+        self.archive = archive
+        self.session = session or httpclient.shared_session()
+        self.body_limits = getattr(self.session, 'body_limits', None)
+
+    def get(self, url, **kwargs):
+        r = self.session.get(url, **kwargs)
+        # 读取响应体后再归档，下载耗时会计入ttfb；大小上限取当前fetch调用的设置
+        httpclient.read_body(r)
+        self.archive.put(url, r)
+        return r
+
+
+class RevalidatingSession(RecordingSession):
+    '''
+    增量扫描：归档中有该url的响应且带ETag/Last-Modified时发送条件请求，
+    目标返回304时直接使用归档中的响应，否则读取新响应并写入归档
+    '''
+    def __init__(self, archive, session=None):
+        super(RevalidatingSession, self).__init__(archive, session)
+        self.lock = threading.Lock()
+        self._stats = {'conditional': 0, 'not_modified': 0}
+
+    def get(self, url, **kwargs):
+        etag, modified = self.archive.validators(url) or (None, None)
+        if not etag and not modified:
+            return super(RevalidatingSession, self).get(url, **kwargs)
+        headers = dict(kwargs.get('headers') or {})
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        kwargs['headers'] = headers
+        r = self.session.get(url, **kwargs)
+        httpclient.read_body(r)
+        stored = self.archive.get(url) if r.status_code == 304 else None
+        with self.lock:
+            self._stats['conditional'] += 1
+            if stored is not None:
+                self._stats['not_modified'] += 1
+        if stored is None:
+            self.archive.put(url, r)
+            return r
+        return stored
+
+    def stats(self):
+        '''发送的条件请求数和其中返回304的数量'''
+        with self.lock:
+            return dict(self._stats)
+
+
+def rules_version():
+    '''规则版本：各引擎规则源的大小和修改时间(同规则快照的失效判断)，规则更新后保存的识别结果不再使用'''
+    import snapshot
+    path, db_path, rule_dir = snapshot.default_paths()
+    return hashlib.sha1(repr(sorted(snapshot.sources(db_path, rule_dir).items())).encode('utf-8')).hexdigest()
+
+
+class ArchiveSession(object):
+    '''从归档回放响应，不发起网络请求，归档中没有的url返回404'''
+    def __init__(self, archive):
+        self.archive = archive
+
+    def get(self, url, **kwargs):
+        response = self.archive.get(url)
+        if response is None:
+            response = httpclient.make_response(url, 404, {}, b'')
+        return response
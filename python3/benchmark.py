@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+指纹引擎离线基准测试，回放保存的响应，不发起任何网络请求
+
+    Usage: python3 benchmark.py -c corpus.jsonl [-n 3] [-e fofa,wappalyzer,webanalyzer] [-M 1] [-o report.json]
+           python3 benchmark.py -r url.txt -c corpus.jsonl
+
+    -c: 语料文件，JSON Lines格式，每行一个响应: {"url", "status", "headers", "body"(base64), "target"}
+        target为该响应所属的主页面url，主页面本身可省略
+    -r: 录制模式，从文件读取url(每行一个)，抓取主页面和favicon写入语料文件
+    -n: 回放轮数，默认为1
+    -e: 参与测试的引擎，逗号分隔，默认全部
+    -M: 指定为1时使用tracemalloc统计Python内存峰值(会拖慢速度)，默认只统计进程最大RSS
+    -o: 把测试结果以JSON格式写入文件
+'''
+
+import sys,json,time,base64,getopt
+import urllib.parse
+
+import TideFinger
+import httpclient
+from Wappalyzer import Wappalyzer, WebPage
+from webanalyzer import webanalyzer
+
+ENGINES = TideFinger.ENGINES
+
+
+def load_corpus(path):
+    '''读取语料，按主页面聚合为 [{'url': 主页面, 'responses': {url: Response}}]'''
+    sites = {}
+    with open(path, encoding='utf-8') as fd:
+        for line in fd:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            target = record.get('target') or record['url']
+            site = sites.setdefault(target, {'url': target, 'responses': {}})
+            site['responses'][record['url']] = httpclient.make_response(
+                record['url'], record.get('status', 200), record.get('headers', {}),
+                base64.b64decode(record.get('body', '')))
+    return list(sites.values())
+
+
+def record_corpus(urls, path):
+    '''抓取主页面和favicon写入语料文件'''
+    count = 0
+    with open(path, 'a', encoding='utf-8') as fd:
+        for url in urls:
+            for sub_url in (url, urllib.parse.urljoin(url, '/favicon.ico')):
+                try:
+                    r = httpclient.fetch(sub_url, timeout=TideFinger.request_timeout, verify=False)
+                except Exception as e:
+                    print("record %s error: %s" % (sub_url, e))
+                    continue
+                record = {'url': sub_url, 'target': url, 'status': r.status_code,
+                          'headers': dict(r.headers),
+                          'body': base64.b64encode(r.content).decode('ascii')}
+                fd.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+    return count
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS返回字节，linux返回KB
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def run_benchmark(sites, engines=ENGINES, rounds=1):
+    latency = {engine: [] for engine in engines}
+    detections = {engine: 0 for engine in engines}
+
+    # 规则只加载一次，只统计匹配耗时
+    load_start = time.perf_counter()
+    if 'wappalyzer' in engines:
+        wappalyzer = Wappalyzer.latest()
+    if 'webanalyzer' in engines:
+        webanalyzer._new_analyzer().reload_rules()
+    load_time = time.perf_counter() - load_start
+
+    pages = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for site in sites:
+            url = site['url']
+            session = httpclient.ReplaySession(site['responses'])
+
+            if 'fofa' in engines:
+                engine_start = time.perf_counter()
+                result = TideFinger.Cmsscanner(url, session=session).run()
+                latency['fofa'].append(time.perf_counter() - engine_start)
+                detections['fofa'] += len(result)
+
+            if 'wappalyzer' in engines:
+                engine_start = time.perf_counter()
+                result = wappalyzer.analyze(WebPage.new_from_response(session.get(url)))
+                latency['wappalyzer'].append(time.perf_counter() - engine_start)
+                detections['wappalyzer'] += len(result)
+
+            if 'webanalyzer' in engines:
+                engine_start = time.perf_counter()
+                result = webanalyzer.analyze(url, session, reload=False)
+                latency['webanalyzer'].append(time.perf_counter() - engine_start)
+                detections['webanalyzer'] += len(result)
+
+            pages += 1
+    total = time.perf_counter() - start
+
+    report = {
+        'pages': pages,
+        'rounds': rounds,
+        'load_seconds': round(load_time, 3),
+        'total_seconds': round(total, 3),
+        'pages_per_second': round(pages / total, 2) if total else 0.0,
+        'engines': {},
+    }
+    for engine in engines:
+        values = [x * 1000 for x in latency[engine]]
+        report['engines'][engine] = {
+            'p50_ms': round(percentile(values, 50), 2),
+            'p90_ms': round(percentile(values, 90), 2),
+            'p99_ms': round(percentile(values, 99), 2),
+            'max_ms': round(max(values), 2) if values else 0.0,
+            'total_ms': round(sum(values), 1),
+            'detections': detections[engine],
+        }
+    return report
+
+
+def print_report(report):
+    print("pages: %d  rounds: %d  rule load: %.3fs  total: %.3fs  pages/sec: %.2f" % (
+        report['pages'], report['rounds'], report['load_seconds'], report['total_seconds'], report['pages_per_second']))
+    print('%-12s %10s %10s %10s %10s %12s %10s' % ('engine', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'max(ms)', 'total(ms)', 'detected'))
+    for engine, item in report['engines'].items():
+        print('%-12s %10.2f %10.2f %10.2f %10.2f %12.1f %10d' % (engine, item['p50_ms'], item['p90_ms'], item['p99_ms'],
+                                                                item['max_ms'], item['total_ms'], item['detections']))
+    if 'peak_python_kb' in report:
+        print("peak python memory: %d KB" % report['peak_python_kb'])
+    print("peak rss: %d KB" % report['peak_rss_kb'])
+
+
+if __name__ == "__main__":
+    try:
+        options, args = getopt.getopt(sys.argv[1:], "c:r:n:e:M:o:")
+    except getopt.GetoptError as e:
+        exit(str(e))
+    corpus = ''
+    url_file = ''
+    rounds = 1
+    engines = ENGINES
+    trace_memory = False
+    report_file = ''
+    for opt, arg in options:
+        if opt == '-c':
+            corpus = arg
+        elif opt == '-r':
+            url_file = arg
+        elif opt == '-n':
+            rounds = int(arg)
+        elif opt == '-e':
+            engines = tuple(x.strip() for x in arg.split(',') if x.strip() in ENGINES)
+        elif opt == '-M':
+            trace_memory = arg == '1'
+        elif opt == '-o':
+            report_file = arg
+
+    if not corpus:
+        exit(__doc__)
+
+    if url_file:
+        urls = [x.strip() for x in open(url_file) if x.strip()]
+        print("recorded %d responses into %s" % (record_corpus(urls, corpus), corpus))
+        exit(0)
+
+    sites = load_corpus(corpus)
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    report = run_benchmark(sites, engines, rounds)
+    if trace_memory:
+        report['peak_python_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    report['peak_rss_kb'] = peak_rss_kb()
+    print_report(report)
+    if report_file:
+        with open(report_file, 'w', encoding='utf-8') as fd:
+            json.dump(report, fd, indent=1)
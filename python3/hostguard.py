@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time,random,threading
+import requests
+
+from ratelimit import host_key
+
+# 熔断：连续失败FAILURE_THRESHOLD次后，COOLDOWN秒内该主机的请求直接失败，之后放行一个试探请求
+FAILURE_THRESHOLD = 5
+COOLDOWN = 30.0
+# 连接失败或收紧的超时到期后重试的次数，第n次重试前等待 BACKOFF * 2**(n-1) 秒并加随机抖动
+RETRIES = 1
+BACKOFF = 0.2
+# 自适应超时：样本数达到ADAPTIVE_SAMPLES后，读取超时取 srtt + 4*rttvar (同TCP的RTO)，不低于ADAPTIVE_MIN、不超过配置值
+# 连接超时不收紧，SYN丢包后重传要等1秒以上
+ADAPTIVE_SAMPLES = 5
+ADAPTIVE_MIN = 2.0
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    '''主机已熔断，请求没有发出'''
+
+
+class HostState(object):
+    __slots__ = ('failures', 'opened_at', 'srtt', 'rttvar', 'samples')
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.srtt = None
+        self.rttvar = 0.0
+        self.samples = 0
+
+
+def split_timeout(timeout):
+    '''requests的timeout拆成 (连接超时, 读取超时)'''
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
+
+
+class HostGuard(object):
+    '''
+    按主机(host_key)记录请求结果：连续失败后熔断、按往返时间收紧超时、决定是否重试
+    成功指收到了响应(任何状态码)，失败指连接错误或超时
+    failure_threshold为0时不熔断，adaptive为False时始终使用配置的超时
+    '''
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN, retries=RETRIES,
+                 backoff=BACKOFF, adaptive=True):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backoff = backoff
+        self.adaptive = adaptive
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self._stats = {'retries': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState()
+        return state
+
+    def check(self, url):
+        '''主机熔断中时抛出CircuitOpen；冷却时间已过则放行一个试探请求'''
+        host = host_key(url)[0]
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None or state.opened_at is None:
+                return
+            now = time.monotonic()
+            if now - state.opened_at >= self.cooldown:
+                # 试探请求期间其他请求仍然直接失败
+                state.opened_at = now
+                return
+            self._stats['rejected'] += 1
+        raise CircuitOpen('%s 连续%d次请求失败，已暂停请求' % (host, state.failures))
+
+    def is_open(self, url):
+        with self.lock:
+            state = self.hosts.get(host_key(url)[0])
+            return state is not None and state.opened_at is not None
+
+    def timeout(self, url, timeout):
+        '''按该主机的往返时间收紧读取超时，样本不足或未指定超时时原样返回'''
+        if not self.adaptive or timeout is None:
+            return timeout
+        with self.lock:
+            state = self.hosts.get(host_key(url)[0])
+            if state is None or state.samples < ADAPTIVE_SAMPLES:
+                return timeout
+            rto = max(state.srtt + 4 * state.rttvar, ADAPTIVE_MIN)
+        connect, read = split_timeout(timeout)
+        return connect, min(read, rto) if read is not None else None
+
+    def success(self, url, rtt):
+        with self.lock:
+            state = self._state(host_key(url)[0])
+            state.failures = 0
+            state.opened_at = None
+            if state.srtt is None:
+                state.srtt = rtt
+                state.rttvar = rtt / 2
+            else:
+                state.rttvar = 0.75 * state.rttvar + 0.25 * abs(state.srtt - rtt)
+                state.srtt = 0.875 * state.srtt + 0.125 * rtt
+            state.samples += 1
+
+    def failure(self, url):
+        with self.lock:
+            state = self._state(host_key(url)[0])
+            state.failures += 1
+            self._stats['failures'] += 1
+            if self.failure_threshold and state.failures >= self.failure_threshold:
+                if state.opened_at is None:
+                    self._stats['opened'] += 1
+                state.opened_at = time.monotonic()
+
+    def should_retry(self, request, error, attempt, tightened=False):
+        '''
+        只重试幂等请求的连接错误；读取超时只在超时被收紧过时重试，用完整超时仍无响应的不再重试
+        证书错误和熔断不重试
+        '''
+        if attempt >= self.retries or request.method not in IDEMPOTENT_METHODS:
+            return False
+        if isinstance(error, (CircuitOpen, requests.exceptions.SSLError)):
+            return False
+        if isinstance(error, requests.exceptions.ReadTimeout) and not tightened:
+            return False
+        with self.lock:
+            self._stats['retries'] += 1
+        return True
+
+    def delay(self, attempt):
+        '''第attempt次重试前等待的秒数，指数退避加随机抖动'''
+        return self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    def stats(self):
+        '''重试次数、失败次数、熔断次数、熔断期间拒绝的请求数和当前熔断的主机数'''
+        with self.lock:
+            stats = dict(self._stats)
+            stats['open'] = sum(1 for state in self.hosts.values() if state.opened_at is not None)
+        return stats
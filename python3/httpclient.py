@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re,time,codecs,socket,threading
+import http.cookiejar
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import poolmanager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+import proxypool
+
+_local = threading.local()
+
+# 连接池缓存的主机数，以及每个主机保持的空闲连接数(与目录探测的默认线程数一致)
+POOL_HOSTS = 100
+POOL_PER_HOST = 50
+
+# 各类请求响应体的大小上限(字节)，超过后停止下载并丢弃连接，防止恶意目标的超大或无限响应占满内存
+BODY_LIMITS = {'main': 2 * 1024 * 1024, 'probe': 1024 * 1024, 'favicon': 256 * 1024}
+ICON_SUFFIXES = ('.ico', '.png', '.gif', '.jpg', '.jpeg', '.svg')
+CHUNK_SIZE = 64 * 1024
+
+# 编码识别：meta标签只在页面开头查找，检测器只使用前一部分样本
+META_SAMPLE = 4096
+DETECT_SAMPLE = 32 * 1024
+HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+# gb2312/gbk页面常混有超出声明字符集的字符，统一按超集gb18030解码
+CHARSET_ALIASES = {'gb2312': 'gb18030', 'gbk': 'gb18030', 'x-gbk': 'gb18030', 'gb_2312-80': 'gb18030'}
+
+# DNS缓存时间(秒)，getaddrinfo拿不到记录的TTL，统一按固定时间过期；解析失败的结果缓存较短时间
+DNS_TTL = 300
+DNS_NEGATIVE_TTL = 30
+
+
+def _record(name, seconds):
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is not None:
+        metrics[name] = metrics.get(name, 0.0) + seconds
+
+
+class DnsCache(object):
+    '''
+    进程内共享的DNS缓存，按主机名缓存getaddrinfo的结果，解析失败也会缓存
+    多个线程同时解析同一主机时只发起一次解析，其余线程等待结果
+    '''
+    def __init__(self, ttl=DNS_TTL, negative_ttl=DNS_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self._stats = {'lookups': 0, 'hits': 0, 'resolved': 0, 'failed': 0}
+
+    def getaddrinfo(self, host):
+        """返回 [(family, sockaddr)]，解析失败时抛出socket.gaierror"""
+        while True:
+            with self.lock:
+                self._stats['lookups'] += 1
+                entry = self.entries.get(host)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._stats['hits'] += 1
+                    result = entry[1]
+                    break
+                event = self.pending.get(host)
+                if event is None:
+                    event = self.pending[host] = threading.Event()
+                    owner = True
+                else:
+                    # 等待其他线程的解析结果后重新查缓存，不重复计数
+                    self._stats['lookups'] -= 1
+                    owner = False
+            if not owner:
+                event.wait()
+                continue
+            try:
+                result = [(family, sockaddr) for family, socktype, proto, canonname, sockaddr
+                          in socket.getaddrinfo(host, None, allowed_gai_family(), socket.SOCK_STREAM)]
+                ttl = self.ttl
+            except OSError as e:
+                result = e
+                ttl = self.negative_ttl
+            except UnicodeError as e:
+                # 主机名不合法(如标签过长)
+                result = socket.gaierror(str(e))
+                ttl = self.negative_ttl
+            with self.lock:
+                self.entries[host] = (time.monotonic() + ttl, result)
+                self._stats['failed' if isinstance(result, OSError) else 'resolved'] += 1
+                del self.pending[host]
+            event.set()
+            break
+        if isinstance(result, OSError):
+            raise result
+        return result
+
+    def resolve(self, hosts, workers=50):
+        """并发解析多个主机名，结果写入缓存，返回 {主机名: 是否解析成功}"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def check(host):
+            try:
+                return bool(self.getaddrinfo(host))
+            except OSError:
+                return False
+
+        hosts = list(dict.fromkeys(hosts))
+        if not hosts:
+            return {}
+        with ThreadPoolExecutor(min(workers, len(hosts))) as executor:
+            return dict(zip(hosts, executor.map(check, hosts)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """查询次数、缓存命中次数、实际解析成功和失败的次数"""
+        with self.lock:
+            stats = dict(self._stats)
+        stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 3) if stats['lookups'] else 0.0
+        return stats
+
+
+dns_cache = DnsCache()
+
+
+def resolve_targets(urls, workers=50):
+    '''预先并发解析全部目标的主机名，返回 (可以解析的url, 无法解析的url)'''
+    hosts = {url: urllib.parse.urlsplit(url).hostname or '' for url in urls}
+    resolved = dns_cache.resolve(hosts.values(), workers)
+    ok = [url for url in urls if resolved.get(hosts[url])]
+    failed = [url for url in urls if not resolved.get(hosts[url])]
+    return ok, failed
+
+
+class _TimedConnection(object):
+    '''
+    PooledSession使用的连接，把DNS解析和TCP建连拆开计时，解析结果使用dns_cache缓存
+    依次连接解析出的各个地址，建连本身和错误处理仍由urllib3完成
+    '''
+    def _new_conn(self):
+        dns_host = self._dns_host
+        host = dns_host.strip('[]')
+
+        start = time.perf_counter()
+        try:
+            infos = dns_cache.getaddrinfo(host)
+        except OSError as e:
+            raise NewConnectionError(self, 'Failed to establish a new connection: %s' % e)
+        finally:
+            _record('dns', time.perf_counter() - start)
+
+        err = None
+        start = time.perf_counter()
+        try:
+            for family, sockaddr in infos:
+                self._dns_host = sockaddr[0]
+                try:
+                    sock = super(_TimedConnection, self)._new_conn()
+                except ConnectTimeoutError as e:
+                    # NewConnectionError是ConnectTimeoutError的子类
+                    err = e
+                    continue
+                finally:
+                    # 连接断开后重连时重新查缓存
+                    self._dns_host = dns_host
+                pool = getattr(_local, 'pool', None)
+                if pool is not None:
+                    pool._count('connections')
+                    if pool.limiter is not None:
+                        pool.limiter.resolved(host, sockaddr[0])
+                return sock
+        finally:
+            _record('connect', time.perf_counter() - start)
+
+        if err is not None:
+            raise err
+        raise NewConnectionError(self, 'Failed to establish a new connection: getaddrinfo returns an empty list')
+
+
+class _TimedHTTPConnection(_TimedConnection, HTTPConnectionPool.ConnectionCls):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnection, HTTPSConnectionPool.ConnectionCls):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+_POOL_CLASSES = {'http': _TimedHTTPConnectionPool, 'https': _TimedHTTPSConnectionPool}
+
+
+class TimedAdapter(HTTPAdapter):
+    '''
+    连接池使用_TimedConnection，只作用于挂载了该adapter的会话，不修改urllib3全局的建连函数
+    返回的响应为Response，text只解码一次
+    '''
+    def build_response(self, req, resp):
+        response = super(TimedAdapter, self).build_response(req, resp)
+        r = Response()
+        r.__dict__.update(response.__dict__)
+        return r
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super(TimedAdapter, self).proxy_manager_for(proxy, **proxy_kwargs)
+        # socks代理有自己的连接类，保持不变
+        if manager.pool_classes_by_scheme is poolmanager.pool_classes_by_scheme:
+            manager.pool_classes_by_scheme = _POOL_CLASSES
+        return manager
+
+
+class _NoCookies(http.cookiejar.DefaultCookiePolicy):
+    def set_ok(self, cookie, request):
+        return False
+
+
+class PooledSession(requests.Session):
+    '''
+    各线程共享的keep-alive会话，同一主机的请求复用已建立的TCP/TLS连接
+    urllib3的连接池本身是线程安全的；会话不保存Cookie，与每次调用requests.get一样不会在目标之间串用
+    pool_per_host应不小于同一主机的并发数，否则多出的连接用完即关闭；block为True时并发超过该数会等待空闲连接
+    指定limiter(ratelimit.RateLimiter)时每个请求发出前按主机/IP/全局限速等待，等待时间记入wait阶段
+    指定guard(hostguard.HostGuard)时按主机熔断、收紧超时，连接失败或超时的幂等请求按guard的设置重试
+    指定proxy_pool(proxypool.ProxyPool)时每个请求从代理池选择代理，代理失败时换一个代理重试，不计入主机的失败
+    '''
+    def __init__(self, pool_hosts=POOL_HOSTS, pool_per_host=POOL_PER_HOST, block=False, body_limits=None,
+                 limiter=None, guard=None, proxy_pool=None):
+        super(PooledSession, self).__init__()
+        self.body_limits = dict(BODY_LIMITS, **(body_limits or {}))
+        self.limiter = limiter
+        self.guard = guard
+        self.proxy_pool = proxy_pool
+        adapter = TimedAdapter(pool_connections=pool_hosts, pool_maxsize=pool_per_host, pool_block=block)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.cookies.set_policy(_NoCookies())
+        self._stats = {'requests': 0, 'connections': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def send(self, request, **kwargs):
+        # 重定向的每一跳都经过send，新建连接由_TimedConnection计入当前会话
+        guard = self.guard
+        proxy_pool = self.proxy_pool
+        timeout = kwargs.get('timeout')
+        attempt = 0
+        # 本次请求已经用过的代理和经过它们的错误
+        tried = []
+        proxy_errors = []
+        while True:
+            if guard is not None:
+                guard.check(request.url)
+                # 重试时使用配置的超时，避免偶尔较慢的页面因收紧的超时连续失败
+                kwargs['timeout'] = guard.timeout(request.url, timeout) if attempt == 0 else timeout
+                tightened = kwargs['timeout'] != timeout
+            self._count('requests')
+            if self.limiter is not None:
+                _record('wait', self.limiter.acquire(request.url))
+            proxy = None
+            if proxy_pool is not None:
+                proxy = proxy_pool.acquire(tried)
+                kwargs['proxies'] = proxy_pool.proxies_for(proxy)
+            start = time.perf_counter()
+            try:
+                r = self._send(request, **kwargs)
+            except Exception as e:
+                if proxy is not None:
+                    proxy_pool.release(proxy, error=e)
+                if not isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                    raise
+                if proxy is not None:
+                    tried.append(proxy)
+                    proxy_errors.append(e)
+                    if proxy_pool.should_retry(request, proxy_errors):
+                        continue
+                    if proxypool.is_proxy_error(e):
+                        # 换代理也失败，问题在代理而不在目标，不计入目标的熔断和限速
+                        raise
+                if self.limiter is not None and isinstance(e, requests.exceptions.Timeout):
+                    self.limiter.feedback(request.url, timeout=True)
+                if guard is None:
+                    raise
+                guard.failure(request.url)
+                if not guard.should_retry(request, e, attempt, tightened):
+                    raise
+                attempt += 1
+                time.sleep(guard.delay(attempt))
+                continue
+            rtt = time.perf_counter() - start
+            if proxy is not None:
+                proxy_pool.release(proxy, rtt)
+            if self.limiter is not None:
+                self.limiter.feedback(request.url, r)
+            if guard is not None:
+                guard.success(request.url, rtt)
+            return r
+
+    def _send(self, request, **kwargs):
+        previous = getattr(_local, 'pool', None)
+        _local.pool = self
+        try:
+            return super(PooledSession, self).send(request, **kwargs)
+        finally:
+            _local.pool = previous
+
+    def stats(self):
+        """请求数、新建连接数和复用连接的请求数"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+        stats['reuse_rate'] = round(stats['reused'] / stats['requests'], 3) if stats['requests'] else 0.0
+        return stats
+
+
+_shared_session = None
+_shared_lock = threading.Lock()
+
+
+def shared_session():
+    '''未指定session时使用的进程内共享会话'''
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            _shared_session = PooledSession()
+        return _shared_session
+
+
+def body_type(kind, url):
+    '''按请求类型和url区分主页面、目录探测和图标，对应BODY_LIMITS中的上限'''
+    if kind == 'probe':
+        return 'probe'
+    path = urllib.parse.urlsplit(url).path.lower()
+    if 'favicon' in path or path.endswith(ICON_SUFFIXES):
+        return 'favicon'
+    return 'main'
+
+
+def read_body(r, limit=None):
+    '''
+    流式读取响应体，超过limit字节时截断并关闭连接，r.truncated标记是否被截断
+    未指定limit时使用当前fetch调用的上限，已读取过的响应直接返回
+    '''
+    if r._content is not False:
+        r.truncated = getattr(r, 'truncated', False)
+        return r.content
+    limit = limit or getattr(_local, 'body_limit', None) or BODY_LIMITS['main']
+    chunks = []
+    size = 0
+    truncated = False
+    for chunk in r.iter_content(CHUNK_SIZE):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            truncated = True
+            break
+    r._content = b''.join(chunks)[:limit]
+    r._content_consumed = True
+    r.truncated = truncated
+    if truncated:
+        # 剩余数据不再读取，连接无法复用
+        r.close()
+    return r._content
+
+
+def fetch(url, timings=None, kind='main', session=None, **kwargs):
+    '''
+    发起GET请求并读取响应体，按 wait/dns/connect/ttfb/download 记录到timings
+    wait为限速等待的时间，建连耗时只在新建连接时产生，ttfb已扣除wait、dns和connect
+    未指定session时使用共享的keep-alive会话
+    响应体按请求类型限制大小(见BODY_LIMITS，session可以用body_limits覆盖)，被截断时r.truncated为True
+    '''
+    session = session or shared_session()
+    limits = getattr(session, 'body_limits', None) or BODY_LIMITS
+    metrics = {'wait': 0.0, 'dns': 0.0, 'connect': 0.0, 'ttfb': 0.0, 'download': 0.0}
+    _local.metrics = metrics
+    _local.body_limit = limits[body_type(kind, url)]
+    kwargs['stream'] = True
+    try:
+        start = time.perf_counter()
+        r = session.get(url, **kwargs)
+        metrics['ttfb'] = max(time.perf_counter() - start - metrics['wait'] - metrics['dns'] - metrics['connect'], 0.0)
+        start = time.perf_counter()
+        read_body(r)
+        metrics['download'] = time.perf_counter() - start
+        metrics['truncated'] = r.truncated
+        if isinstance(r, Response) and r.timings is None:
+            r.timings = timings
+        return r
+    finally:
+        _local.metrics = None
+        _local.body_limit = None
+        if timings is not None:
+            timings.add_request(kind, url, metrics)
+
+
+class TimedSession(object):
+    '''
+    提供给Wappalyzer/webanalyzer使用的session，只实现get，请求耗时记入timings
+    '''
+    def __init__(self, timings=None, kind='main', session=None):
+        self.timings = timings
+        self.kind = kind
+        self.session = session
+
+    @property
+    def body_limits(self):
+        return getattr(self.session, 'body_limits', None)
+
+    def get(self, url, **kwargs):
+        return fetch(url, self.timings, self.kind, self.session, **kwargs)
+
+
+def _charset(name):
+    '''规范化编码名，无法识别时返回None'''
+    if isinstance(name, bytes):
+        name = name.decode('ascii', 'ignore')
+    name = CHARSET_ALIASES.get(name.strip().lower(), name.strip().lower())
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def _detect(sample):
+    from requests.compat import chardet
+    if chardet is None:
+        return None
+    return chardet.detect(sample).get('encoding')
+
+
+def decode(content, headers, charset=None):
+    '''
+    解码响应体，返回 (文本, 编码)
+    编码依次取自: 已知编码、header中的charset、页面开头meta中的charset、utf-8、对样本的编码检测、gb18030
+    '''
+    if not content:
+        return '', charset or 'utf-8'
+    if not charset:
+        match = HEADER_CHARSET_RE.search(headers.get('content-type', ''))
+        charset = match and _charset(match.group(1))
+    if not charset:
+        match = META_CHARSET_RE.search(content[:META_SAMPLE])
+        charset = match and _charset(match.group(1))
+    if charset:
+        return content.decode(charset, 'replace'), charset
+    try:
+        return content.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    charset = _charset(_detect(content[:DETECT_SAMPLE]) or '')
+    if charset:
+        return content.decode(charset, 'replace'), charset
+    # 检测不出时多为未声明编码的中文页面
+    try:
+        return content.decode('gb18030'), 'gb18030'
+    except UnicodeDecodeError:
+        return content.decode('utf-8', 'replace'), 'utf-8'
+
+
+class Response(requests.models.Response):
+    '''
+    text只解码一次并缓存，Wappalyzer、webanalyzer等多次读取text时不再重复解码和检测编码
+    解码耗时记入timings的decode阶段
+    PooledSession的请求(由TimedAdapter构造)和离线回放的响应都是该类型
+    '''
+    timings = None
+    charset = None
+
+    @property
+    def text(self):
+        text = self.__dict__.get('_text')
+        if text is None:
+            start = time.perf_counter()
+            text, self.charset = decode(self.content, self.headers, self.charset)
+            self.encoding = self.charset
+            self._text = text
+            if self.timings is not None:
+                self.timings.add('decode', time.perf_counter() - start)
+        return text
+
+
+def make_response(url, status, headers, content, charset=None):
+    '''用保存下来的数据构造Response，供离线回放使用，charset为已知的编码'''
+    r = Response()
+    r.url = url
+    r.status_code = status
+    r.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    r._content = content or b''
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+    r.charset = charset
+    r.cookies = requests.cookies.RequestsCookieJar()
+    return r
+
+
+class ReplaySession(object):
+    '''
+    离线回放用的session，按url返回保存的响应，未保存的url返回404
+    '''
+    def __init__(self, responses=None):
+        self.responses = {}
+        for url, response in (responses or {}).items():
+            self.add(url, response)
+
+    def add(self, url, response):
+        self.responses[url.rstrip('/')] = response
+
+    def get(self, url, **kwargs):
+        response = self.responses.get(url.rstrip('/'))
+        if response is None:
+            response = make_response(url, 404, {}, b'')
+        return response
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import threading
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+_local = threading.local()
+
+# 规则多来自JavaScript，少数正则Python无法编译，按永不命中处理
+# http://stackoverflow.com/a/1845097/413622
+NEVER_MATCH = re.compile(r'(?!x)x')
+
+
+def _lower(string):
+    '''同一段页面文本会被上千条规则检查，缓存最近几段长文本的小写形式'''
+    if len(string) < 256:
+        return string.lower()
+    cache = getattr(_local, 'lowered', None)
+    if cache is None:
+        cache = _local.lowered = []
+    for original, lowered in cache:
+        if original is string:
+            return lowered
+    lowered = string.lower()
+    cache.insert(0, (string, lowered))
+    del cache[4:]
+    return lowered
+
+
+def required_literal(pattern, flags=0):
+    '''
+    找出任何匹配都必须包含的最长字面量(小写)，匹配前先检查文本是否包含它
+    只处理忽略大小写的正则；忽略大小写时i/s还能匹配非ASCII字符，不参与字面量
+    '''
+    if not flags & re.I:
+        return None
+    try:
+        items = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+
+    runs = ['']
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_parse.LITERAL and av < 128 and chr(av).lower() not in 'is':
+                runs[-1] += chr(av).lower()
+            elif op is sre_parse.SUBPATTERN:
+                walk(av[-1])
+            else:
+                runs.append('')
+
+    walk(items)
+    literal = max(runs, key=len)
+    return literal if len(literal) >= 2 else None
+
+
+class LazyRegex(object):
+    '''
+    第一次使用时才编译的正则，序列化时只保存表达式、标志和必需字面量
+    规则快照和Wappalyzer中的正则都以这种形式保存，加载时不需要编译，无法编译的正则永不命中
+    文本中不包含必需字面量时直接返回未命中，不编译也不执行正则
+    '''
+    __slots__ = ('pattern', 'flags', 'literal', '_regex')
+
+    def __init__(self, pattern, flags=0, literal=None):
+        self.pattern = pattern
+        self.flags = flags
+        self.literal = literal
+        self._regex = None
+
+    @property
+    def regex(self):
+        if self._regex is None:
+            try:
+                self._regex = re.compile(self.pattern, self.flags)
+            except re.error:
+                self._regex = NEVER_MATCH
+        return self._regex
+
+    @property
+    def compiled(self):
+        return self._regex is not None
+
+    def _absent(self, string):
+        return self.literal is not None and isinstance(string, str) and self.literal not in _lower(string)
+
+    def search(self, string, *args):
+        if self._absent(string):
+            return None
+        return self.regex.search(string, *args)
+
+    def match(self, string, *args):
+        if self._absent(string):
+            return None
+        return self.regex.match(string, *args)
+
+    def findall(self, string, *args):
+        if self._absent(string):
+            return []
+        return self.regex.findall(string, *args)
+
+    def __getstate__(self):
+        return self.pattern, self.flags, self.literal
+
+    def __setstate__(self, state):
+        self.pattern, self.flags, self.literal = state
+        self._regex = None
+
+    def __repr__(self):
+        return 'LazyRegex(%r)' % self.pattern
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+本地模拟站点，用于不访问真实站点的端到端吞吐测试
+每个站点监听一个本地端口，站点内容来自录制的语料或cms表中的关键字指纹
+
+    Usage: python3 mockserver.py [-c corpus.jsonl] [-s 20] [-l 30] [-j 10] [-4 1] [-q 100] [-x 2] [-y 3] [-b 1] [-w 4] [-p 2] [-d 1] [-m 50] [-t 5] [-r 50,0,0]
+
+    -c: 录制的语料文件(格式见benchmark.py)，每个主页面对应一个站点
+    -s: 从cms_finger.db的cms表生成的模拟站点数量，默认为0
+    -D: cms指纹库路径，默认为当前目录下的cms_finger.db
+    -l: 每个响应的固定延迟(毫秒)，默认为0
+    -j: 每个响应额外的随机延迟上限(毫秒)，默认为0
+    -4: 指定为1时模拟软404，不存在的路径返回200和通用页面
+    -q: 模拟WAF，每个站点每秒超过指定请求数后返回429，默认为0(不限制)
+    -x: 额外的无响应站点数量，这些端口接受连接但从不返回数据，默认为0
+    -y: 吞吐测试经过的代理数量，这些代理全部无法连接，用于检查代理失败不会使目标熔断，默认为0
+    -b: 指定为1时运行端到端吞吐测试，否则只启动站点并打印目标地址
+    -w: 吞吐测试并发扫描的目标数，默认为1
+    -p: 吞吐测试使用流水线模式，指定匹配进程数，此时-w为抓取线程数，默认为0(不使用流水线)
+    -d: 吞吐测试是否启用目录匹配式探测，默认为0
+    -m: 目录探测的线程数，默认为50
+    -t: 请求超时时间，默认为5秒，格式同TideFinger.py的-t
+    -r: 吞吐测试的限速，格式同TideFinger.py的-r
+'''
+
+import sys,time,random,socket,sqlite3,getopt,threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SOFT_404_PAGE = b'<html><head><title>Page not found</title></head><body>Sorry, the page you requested was not found.</body></html>'
+
+# 录制的响应已经解压，这些头不能原样返回
+SKIP_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length', 'connection')
+
+
+class MockSite(object):
+    def __init__(self, name):
+        self.name = name
+        self.pages = {}
+
+    def add(self, path, status, headers, body):
+        self.pages[path or '/'] = (status, headers, body)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            throttled = False
+            if server.max_rate:
+                second = int(time.time())
+                if second != server.window:
+                    server.window, server.window_requests = second, 0
+                server.window_requests += 1
+                throttled = server.window_requests > server.max_rate
+                server.throttled += throttled
+
+        if throttled:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+
+        path = urllib.parse.urlsplit(self.path).path
+        page = server.site.pages.get(path)
+        if page is None:
+            if server.soft_404:
+                page = (200, {'Content-Type': 'text/html'}, SOFT_404_PAGE)
+            else:
+                page = (404, {'Content-Type': 'text/html'}, b'Not Found')
+
+        status, headers, body = page
+        self.send_response(status)
+        for key, value in headers.items():
+            if key.lower() not in SKIP_HEADERS:
+                self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(object):
+    '''为每个站点启动一个本地HTTP服务'''
+    def __init__(self, sites, latency=0, jitter=0, soft_404=False, max_rate=0, hung=0, dead_proxies=0):
+        self.sites = sites
+        self.dead_proxies = dead_proxies
+        self.proxy_ports = []
+        self.max_rate = max_rate
+        self.hung = hung
+        self.hung_sockets = []
+        self.latency = latency / 1000.0
+        self.jitter = jitter / 1000.0
+        self.soft_404 = soft_404
+        self.servers = []
+
+    def start(self):
+        for site in self.sites:
+            httpd = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+            httpd.daemon_threads = True
+            httpd.site = site
+            httpd.latency = self.latency
+            httpd.jitter = self.jitter
+            httpd.soft_404 = self.soft_404
+            httpd.requests = 0
+            httpd.max_rate = self.max_rate
+            httpd.window = 0
+            httpd.window_requests = 0
+            httpd.throttled = 0
+            httpd.lock = threading.Lock()
+            thread = threading.Thread(target=httpd.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self.servers.append(httpd)
+        for i in range(self.hung):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(1024)
+            self.hung_sockets.append(sock)
+        for i in range(self.dead_proxies):
+            # 取一个空闲端口后关闭，连接该端口会被拒绝
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('127.0.0.1', 0))
+            self.proxy_ports.append(sock.getsockname()[1])
+            sock.close()
+        return self.targets()
+
+    def proxies(self):
+        return ['127.0.0.1:%d' % port for port in self.proxy_ports]
+
+    def targets(self):
+        return ['http://127.0.0.1:%d/' % x.server_address[1] for x in self.servers] + \
+               ['http://127.0.0.1:%d/' % x.getsockname()[1] for x in self.hung_sockets]
+
+    def requests(self):
+        return sum(httpd.requests for httpd in self.servers)
+
+    def throttled(self):
+        return sum(httpd.throttled for httpd in self.servers)
+
+    def stop(self):
+        for httpd in self.servers:
+            httpd.shutdown()
+            httpd.server_close()
+        for sock in self.hung_sockets:
+            sock.close()
+
+
+def sites_from_corpus(path):
+    import benchmark
+    sites = []
+    for item in benchmark.load_corpus(path):
+        site = MockSite(item['url'])
+        for url, r in item['responses'].items():
+            site.add(urllib.parse.urlsplit(url).path, r.status_code, dict(r.headers), r.content)
+        sites.append(site)
+    return sites
+
+
+def sites_from_cms(db_path, num):
+    '''按cms表的关键字指纹生成站点，md5和正则指纹无法还原内容，不参与生成'''
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT cms_name, path, match_pattern FROM cms WHERE options='keyword'").fetchall()
+    products = {}
+    for cms_name, path, match_pattern in rows:
+        products.setdefault(cms_name, []).append((path, match_pattern))
+
+    sites = []
+    for cms_name in random.sample(sorted(products), min(num, len(products))):
+        site = MockSite(cms_name)
+        site.add('/', 200, {'Content-Type': 'text/html; charset=utf-8', 'Server': 'nginx'},
+                 ('<html><head><title>%s</title></head><body>welcome</body></html>' % cms_name).encode('utf-8'))
+        for path, match_pattern in products[cms_name]:
+            site.add(path, 200, {'Content-Type': 'text/html; charset=utf-8'},
+                     ('<html><body>%s</body></html>' % match_pattern).encode('utf-8'))
+        sites.append(site)
+    return sites
+
+
+def run_e2e(server, targets, dir_mode=0, workers=1, processes=0, config=None):
+    '''调用TideFinger完整流程扫描全部站点，统计吞吐(规则加载不计入耗时)'''
+    import TideFinger
+    with TideFinger.Scanner(dir_mode=dir_mode, workers=workers, processes=processes, config=config) as scanner:
+        requests_before = server.requests()
+        throttled_before = server.throttled()
+        start = time.time()
+        results = scanner.scan_many(targets)
+        total = time.time() - start
+        pool_stats = scanner.pool_stats()
+        rate_stats = scanner.rate_stats()
+        guard_stats = scanner.guard_stats()
+        proxy_stats = scanner.proxy_stats()
+
+    requests = server.requests() - requests_before
+    report = {
+        'targets': len(targets),
+        'workers': workers,
+        'processes': processes,
+        'dir_mode': dir_mode,
+        'total_seconds': round(total, 3),
+        'targets_per_minute': round(len(targets) * 60 / total, 2) if total else 0.0,
+        'requests': requests,
+        'requests_per_target': round(requests / len(targets), 1) if targets else 0.0,
+        'identified': len([x for x in results if x['cms'] != 'Not Found']),
+        'connections': pool_stats['connections'],
+        'reuse_rate': pool_stats['reuse_rate'],
+        'throttled_responses': server.throttled() - throttled_before,
+    }
+    if rate_stats:
+        report.update(('rate_' + key, value) for key, value in rate_stats.items())
+    if guard_stats:
+        report.update(('guard_' + key, value) for key, value in guard_stats.items())
+    if proxy_stats:
+        report.update(('proxy_' + key, value) for key, value in proxy_stats.items() if key != 'detail')
+    return report
+
+
+if __name__ == "__main__":
+    try:
+        options, args = getopt.getopt(sys.argv[1:], "c:s:D:l:j:4:q:x:y:b:w:p:d:m:t:r:")
+    except getopt.GetoptError as e:
+        exit(str(e))
+    corpus = ''
+    synthetic = 0
+    db_path = 'cms_finger.db'
+    latency = 0
+    jitter = 0
+    soft_404 = False
+    max_rate = 0
+    hung = 0
+    dead_proxies = 0
+    bench = False
+    workers = 1
+    processes = 0
+    dir_mode = 0
+    check_thunder = 50
+    request_timeout = 5
+    connect_timeout = None
+    rate_limits = ()
+    for opt, arg in options:
+        if opt == '-c':
+            corpus = arg
+        elif opt == '-s':
+            synthetic = int(arg)
+        elif opt == '-D':
+            db_path = arg
+        elif opt == '-l':
+            latency = float(arg)
+        elif opt == '-j':
+            jitter = float(arg)
+        elif opt == '-4':
+            soft_404 = arg == '1'
+        elif opt == '-q':
+            max_rate = int(arg)
+        elif opt == '-x':
+            hung = int(arg)
+        elif opt == '-y':
+            dead_proxies = int(arg)
+        elif opt == '-b':
+            bench = arg == '1'
+        elif opt == '-w':
+            workers = int(arg)
+        elif opt == '-p':
+            processes = int(arg)
+        elif opt == '-d':
+            dir_mode = int(arg)
+        elif opt == '-m':
+            check_thunder = int(arg)
+        elif opt == '-t':
+            timeouts = [float(x) for x in arg.split(',')]
+            request_timeout = timeouts[-1]
+            if len(timeouts) > 1:
+                connect_timeout = timeouts[0]
+        elif opt == '-r':
+            rate_limits = tuple(float(x) if x.strip() else 0 for x in arg.split(','))
+
+    sites = []
+    if corpus:
+        sites.extend(sites_from_corpus(corpus))
+    if synthetic:
+        sites.extend(sites_from_cms(db_path, synthetic))
+    if not sites and not hung:
+        exit(__doc__)
+
+    server = MockServer(sites, latency, jitter, soft_404, max_rate, hung, dead_proxies)
+    targets = server.start()
+
+    if bench:
+        import TideFinger
+        config = TideFinger.ScanConfig(request_timeout, check_thunder, server.proxies(), rate_limits=rate_limits,
+                                         connect_timeout=connect_timeout)
+        report = run_e2e(server, targets, dir_mode, workers, processes, config)
+        server.stop()
+        for key, value in report.items():
+            print('%-20s %s' % (key, value))
+    else:
+        for site, target in zip(sites, targets):
+            print(target, site.name)
+        for target in targets[len(sites):]:
+            print(target, '(no response)')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys,json,threading
+
+
+class JsonlWriter(object):
+    '''
+    JSON Lines结果输出，每个目标完成后立即写入一行
+    path为'-'时写到标准输出，已存在的文件会被覆盖
+    '''
+    def __init__(self, path, buffering=64 * 1024):
+        self.path = path
+        self.lock = threading.Lock()
+        if path == '-':
+            self.fd = sys.stdout
+            self.need_close = False
+        else:
+            self.fd = open(path, 'w', encoding='utf-8', buffering=buffering)
+            self.need_close = True
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            self.fd.write(line + '\n')
+            # 每条记录刷新一次，下游可以边扫边读
+            self.fd.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.need_close:
+                self.fd.close()
+            else:
+                self.fd.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
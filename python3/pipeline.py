@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+批量扫描的流水线模式
+抓取线程只下载主页面和图标，原始响应交给工作进程匹配
+指纹匹配是纯Python的CPU计算，受GIL限制，多线程无法利用多核，改由多个进程并行执行
+每个工作进程只加载一次规则，fork启动时直接通过写时复制共享父进程已加载的规则
+'''
+
+import os,re,sys,time,multiprocessing
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import httpclient
+from timing import Timings
+
+FETCHERS = 20
+
+ICON_RE = re.compile(r'<link\b[^>]*\brel=["\']?[^"\'>]*\bicon\b[^>]*>', re.I)
+HREF_RE = re.compile(r'\bhref=["\']?([^"\'\s>]+)', re.I)
+
+_wappalyzer = None
+# 工作进程内的结果缓存，同一进程匹配过的相同响应直接复用结果
+_cache = None
+
+
+def load_rules():
+    '''加载三个引擎的规则，每个进程只加载一次'''
+    global _wappalyzer, _cache
+    if _wappalyzer is not None:
+        return
+    import TideFinger
+    import resultcache
+    TideFinger.load_rules()
+    _wappalyzer = TideFinger.new_wappalyzer()
+    _cache = resultcache.ResultCache()
+
+
+def _mp_context():
+    if sys.platform.startswith('linux'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _raw(url, r):
+    # 抓取线程已确定的编码随响应传给工作进程，不再重复检测
+    return (url, r.url, r.status_code, dict(r.headers), r.content, getattr(r, 'charset', None))
+
+
+def _icon_urls(url, html):
+    '''与webanalyzer一致：/favicon.ico 加上页面中第一个绝对地址的图标'''
+    favicon_url = urllib.parse.urljoin(url, '/favicon.ico')
+    icons = [favicon_url]
+    for tag in ICON_RE.findall(html):
+        href = HREF_RE.search(tag)
+        if not href:
+            continue
+        icon_url = urllib.parse.urljoin(url, href.group(1))
+        if icon_url != favicon_url and icon_url.startswith(('http://', 'https://')):
+            icons.append(icon_url)
+            break
+    return icons
+
+
+def fetch_page(url, session=None, engines=None, stop_on_cms=False, config=None, dedup=True):
+    '''抓取线程：下载主页面和图标，返回可以跨进程传递的原始响应'''
+    import TideFinger
+    engines = engines or TideFinger.ENGINES
+    config = config or TideFinger.ScanConfig()
+    page = {'url': url, 'start': time.time(), 'timings': Timings(), 'responses': [], 'result': None,
+            'engines': engines, 'stop_on_cms': stop_on_cms, 'dedup': dedup}
+    timings = page['timings']
+    try:
+        r = httpclient.fetch(url, timings, 'main', session, headers=TideFinger.agent,
+                             timeout=config.timeout, verify=False)
+    except Exception as e:
+        print("fetch %s error: %s" % (url, e))
+        return 'match', page
+    page['responses'].append(_raw(url, r))
+
+    # 图标只有webanalyzer使用
+    if 'webanalyzer' not in engines:
+        return 'match', page
+    for icon_url in _icon_urls(url, r.text):
+        try:
+            icon = httpclient.fetch(icon_url, timings, 'webanalyzer', session,
+                                    timeout=config.timeout, verify=False)
+        except Exception as e:
+            continue
+        page['responses'].append(_raw(icon_url, icon))
+    return 'match', page
+
+
+def _match_engine(engine, url, main, session, engines, timings, cache=None):
+    '''在工作进程中运行单个指纹引擎，结果写入engines，返回识别出的产品名列表'''
+    import TideFinger
+    from webanalyzer import webanalyzer
+
+    if engine == 'fofa':
+        cms = TideFinger.Cmsscanner(url, timings, cache=cache)
+        fofa_finger = cms.match_response(main)
+        engines['fofa'] = [{'name': x} for x in fofa_finger]
+        return list(fofa_finger)
+
+    if engine == 'wappalyzer':
+        try:
+            engines['wappalyzer'] = TideFinger.match_wappalyzer(_wappalyzer, main, timings, cache)
+            return [str(x['name']).replace('\\;confidence:50', '') for x in engines['wappalyzer']]
+        except Exception as e:
+            print("Wappalyzer check error:", e)
+
+    elif engine == 'webanalyzer':
+        try:
+            engines['webanalyzer'] = webanalyzer.analyze(url, session, timings, reload=False, cache=cache)
+            return webanalyzer.banner(engines['webanalyzer'])
+        except Exception as e:
+            print("Webanalyzer check error:", e)
+    return []
+
+
+def match_page(page):
+    '''工作进程：对抓取结果运行选定的指纹引擎，不发起网络请求'''
+    import TideFinger
+    load_rules()
+
+    url = page['url']
+    timings = page['timings']
+    result = {'url': url, 'cms': 'Not Found', 'banner': [], 'engines': {}}
+    page['result'] = result
+    responses = page['responses']
+    page['responses'] = []
+    if not responses:
+        return 'done', page
+
+    session = httpclient.ReplaySession()
+    for sub_url, final_url, status, headers, content, charset in responses:
+        session.add(sub_url, httpclient.make_response(final_url, status, headers, content, charset))
+    main = session.get(url)
+    cache = _cache if page['dedup'] else None
+    banner = []
+
+    for engine in TideFinger.ENGINES:
+        if engine not in page['engines']:
+            continue
+        with timings.stage(engine):
+            banner.extend(_match_engine(engine, url, main, session, result['engines'], timings, cache))
+        if page['stop_on_cms'] and TideFinger.pick_cms(TideFinger.merge_banner(banner)):
+            break
+
+    with timings.stage('merge'):
+        result['banner'] = TideFinger.merge_banner(banner)
+    cms_name = TideFinger.pick_cms(result['banner'])
+    if cms_name:
+        result['cms'] = cms_name
+        return 'done', page
+    return 'dir', page
+
+
+def dir_query(page, session=None, config=None):
+    '''抓取线程：主页面未识别出cms时进行目录探测'''
+    import TideFinger
+    timings = page['timings']
+    with timings.stage('dir'):
+        cms_name_tmp = TideFinger.finger_query(page['url'], timings, session, config)
+    page['result']['engines']['dir'] = cms_name_tmp or {}
+    if cms_name_tmp:
+        page['result']['cms'] = cms_name_tmp['cms_name']
+    return 'done', page
+
+
+def run(targets, processes=None, fetchers=FETCHERS, dir_mode=0, session=None, callback=None,
+        engines=None, stop_on_cms=False, config=None, dedup=True):
+    '''
+    流水线扫描全部目标，结果按完成顺序交给callback，返回全部结果
+    结果格式与TideFinger.scan_target一致，engines、stop_on_cms和config的含义也与之相同
+    dedup为True时工作进程复用相同响应的匹配结果
+    '''
+    import TideFinger
+    config = config or TideFinger.ScanConfig()
+    processes = processes or os.cpu_count() or 1
+    context = _mp_context()
+    if context.get_start_method() == 'fork':
+        load_rules()
+
+    results = []
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=load_rules) as cpu_pool:
+        # fork方式下首次提交任务时一次性创建全部进程，先于抓取线程启动，避免带锁fork
+        cpu_pool.submit(load_rules).result()
+        with ThreadPoolExecutor(fetchers) as io_pool:
+            pending = set(io_pool.submit(fetch_page, url, session, engines, stop_on_cms, config, dedup)
+                           for url in targets)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step, page = future.result()
+                    if step == 'match':
+                        pending.add(cpu_pool.submit(match_page, page))
+                    elif step == 'dir' and dir_mode == 1:
+                        pending.add(io_pool.submit(dir_query, page, session, config))
+                    else:
+                        result = page['result']
+                        result['truncated'] = list(page['timings'].truncated)
+                        result['cached'] = list(page['timings'].cached)
+                        result['timings'] = page['timings'].to_dict()
+                        result['elapsed'] = round(time.time() - page['start'], 3)
+                        results.append(result)
+                        if callback:
+                            callback(result)
+    return results
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json,threading
+
+
+class RuleProfiler(object):
+    '''
+    规则级耗时统计，按 (引擎, 规则) 记录累计耗时、调用次数和命中次数
+    用于找出耗时异常的正则和从不命中的规则
+    '''
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def record(self, engine, rule, seconds, hit):
+        key = (engine, rule)
+        with self.lock:
+            item = self.stats.get(key)
+            if item is None:
+                item = self.stats[key] = [0.0, 0, 0]
+            item[0] += seconds
+            item[1] += 1
+            if hit:
+                item[2] += 1
+
+    def rows(self):
+        with self.lock:
+            rows = [{'engine': engine, 'rule': rule,
+                     'time_ms': round(item[0] * 1000, 3),
+                     'calls': item[1],
+                     'hits': item[2],
+                     'avg_us': round(item[0] * 1e6 / item[1], 1) if item[1] else 0.0}
+                    for (engine, rule), item in self.stats.items()]
+        rows.sort(key=lambda x: x['time_ms'], reverse=True)
+        return rows
+
+    def summary(self):
+        '''各引擎的总耗时、规则数和从未命中的规则数'''
+        result = {}
+        for row in self.rows():
+            item = result.setdefault(row['engine'], {'time_ms': 0.0, 'rules': 0, 'never_hit': 0})
+            item['time_ms'] = round(item['time_ms'] + row['time_ms'], 3)
+            item['rules'] += 1
+            if not row['hits']:
+                item['never_hit'] += 1
+        return result
+
+    def report(self, limit=30):
+        lines = ['%-12s %-40s %12s %8s %6s %10s' % ('engine', 'rule', 'time(ms)', 'calls', 'hits', 'avg(us)')]
+        for row in self.rows()[:limit]:
+            lines.append('%-12s %-40s %12.3f %8d %6d %10.1f' % (row['engine'], str(row['rule'])[:40], row['time_ms'],
+                                                              row['calls'], row['hits'], row['avg_us']))
+        for engine, item in sorted(self.summary().items()):
+            lines.append('%s: %d rules, %.3f ms, %d never hit' % (engine, item['rules'], item['time_ms'], item['never_hit']))
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as fd:
+            json.dump({'summary': self.summary(), 'rules': self.rows()}, fd, ensure_ascii=False, indent=1)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time,random,threading
+import requests
+
+# 每个代理同时进行的请求数上限，全部代理都达到上限时请求等待空闲代理
+CONCURRENCY = 10
+# 连续失败FAILURE_THRESHOLD次，或样本数不少于MIN_SAMPLES且失败率不低于FAILURE_RATE时剔除代理
+FAILURE_THRESHOLD = 3
+FAILURE_RATE = 0.5
+MIN_SAMPLES = 10
+# 失败率和往返时间按指数加权平均，ALPHA为新样本的权重
+ALPHA = 0.2
+# 剔除COOLDOWN秒后重新试用一个请求，成功则恢复，仍失败则冷却时间加倍，不超过MAX_COOLDOWN
+COOLDOWN = 30.0
+MAX_COOLDOWN = 300.0
+# 代理失败时换一个代理重试的次数，不计入hostguard的重试次数；读取超时无法区分代理和目标的问题，只换代理重试一次
+RETRIES = 2
+TIMEOUT_RETRIES = 1
+# 还没有往返时间样本的代理按DEFAULT_RTT秒计算
+DEFAULT_RTT = 0.5
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class NoProxyAvailable(requests.exceptions.ProxyError):
+    '''全部代理都已剔除，请求没有发出'''
+
+
+class Proxy(object):
+    __slots__ = ('url', 'inflight', 'srtt', 'fail_rate', 'failures', 'samples', 'evicted_until', 'cooldown',
+                 'probation', 'requests', 'errors')
+
+    def __init__(self, url, cooldown):
+        self.url = url
+        self.inflight = 0
+        self.srtt = None
+        self.fail_rate = 0.0
+        self.failures = 0
+        self.samples = 0
+        self.evicted_until = None
+        self.cooldown = cooldown
+        self.probation = False
+        self.requests = 0
+        self.errors = 0
+
+
+def normalize(proxy):
+    '''proxys_ips.txt中的 124.225.223.101:80 补全为 http://124.225.223.101:80'''
+    proxy = proxy.strip()
+    return proxy if '://' in proxy else 'http://' + proxy
+
+
+def is_proxy_error(error):
+    '''
+    连接代理失败、代理断开连接属于代理的问题；证书错误与代理无关
+    代理对CONNECT返回错误状态码(Tunnel connection failed)说明目标无法连接，也不算代理失败
+    '''
+    if isinstance(error, requests.exceptions.SSLError):
+        return False
+    if isinstance(error, requests.exceptions.ProxyError):
+        return 'Tunnel connection failed' not in str(error)
+    return isinstance(error, requests.exceptions.ConnectionError)
+
+
+class ProxyPool(object):
+    '''
+    代理池：按往返时间、失败率和当前并发选择代理，每个代理的并发不超过concurrency
+    代理失败过多时剔除，冷却后重新试用；全部剔除时请求直接失败(NoProxyAvailable)
+    http和https请求都经过代理
+    '''
+    def __init__(self, proxies, concurrency=CONCURRENCY, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN,
+                 retries=RETRIES):
+        urls = []
+        for proxy in proxies:
+            if proxy.strip() and normalize(proxy) not in urls:
+                urls.append(normalize(proxy))
+        self.proxies = [Proxy(url, cooldown) for url in urls]
+        self.concurrency = concurrency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.retries = retries
+        self.cond = threading.Condition()
+        self._stats = {'waited': 0, 'rejected': 0, 'evicted': 0, 'readmitted': 0}
+
+    def __len__(self):
+        return len(self.proxies)
+
+    @staticmethod
+    def _score(proxy):
+        srtt = DEFAULT_RTT if proxy.srtt is None else proxy.srtt
+        return srtt * (1 + proxy.inflight) / max(1 - proxy.fail_rate, 0.05)
+
+    def acquire(self, exclude=()):
+        '''
+        选择一个代理并占用一个并发名额，用完后必须调用release
+        exclude为本次请求已经失败过的代理，还有其他可用代理时不再选择
+        '''
+        with self.cond:
+            waited = False
+            while True:
+                now = time.monotonic()
+                candidates = []
+                admitted = False
+                for proxy in self.proxies:
+                    if proxy.evicted_until is not None:
+                        if now < proxy.evicted_until:
+                            continue
+                        # 冷却结束，试用期间只允许一个请求
+                        proxy.evicted_until = None
+                        proxy.probation = True
+                    admitted = True
+                    if proxy.inflight < (1 if proxy.probation else self.concurrency):
+                        candidates.append(proxy)
+                others = [proxy for proxy in candidates if proxy not in exclude]
+                if others:
+                    candidates = others
+                if candidates:
+                    # 随机取两个选较优的，避免所有线程同时涌向同一个代理
+                    proxy = min(random.sample(candidates, min(len(candidates), 2)), key=self._score)
+                    proxy.inflight += 1
+                    proxy.requests += 1
+                    if waited:
+                        self._stats['waited'] += 1
+                    return proxy
+                if not admitted:
+                    self._stats['rejected'] += 1
+                    raise NoProxyAvailable('全部%d个代理都已剔除' % len(self.proxies))
+                waited = True
+                self.cond.wait(1.0)
+
+    def release(self, proxy, rtt=None, error=None):
+        '''
+        归还并发名额并记录结果：error为None表示收到了响应，rtt为收到响应头的耗时
+        读取超时也计入代理的失败率(接受连接后不响应的代理)；
+        目标本身无响应时hostguard很快熔断该主机，不会因此剔除全部代理
+        '''
+        failed = error is not None and (is_proxy_error(error) or isinstance(error, requests.exceptions.Timeout))
+        with self.cond:
+            proxy.inflight -= 1
+            if error is None:
+                proxy.failures = 0
+                proxy.samples += 1
+                proxy.fail_rate *= 1 - ALPHA
+                if rtt is not None:
+                    proxy.srtt = rtt if proxy.srtt is None else (1 - ALPHA) * proxy.srtt + ALPHA * rtt
+                if proxy.probation:
+                    proxy.probation = False
+                    proxy.cooldown = self.cooldown
+                    self._stats['readmitted'] += 1
+            elif failed:
+                proxy.errors += 1
+                proxy.failures += 1
+                proxy.samples += 1
+                proxy.fail_rate = (1 - ALPHA) * proxy.fail_rate + ALPHA
+                if proxy.probation:
+                    proxy.cooldown = min(proxy.cooldown * 2, MAX_COOLDOWN)
+                    self._evict(proxy)
+                elif proxy.evicted_until is None and (
+                        proxy.failures >= self.failure_threshold or
+                        (proxy.samples >= MIN_SAMPLES and proxy.fail_rate >= FAILURE_RATE)):
+                    self._evict(proxy)
+            self.cond.notify_all()
+
+    def should_retry(self, request, errors):
+        '''
+        errors为本次请求经过各代理的错误(最后一个为当前错误)，决定是否换一个代理重试
+        代理失败的请求换代理重试，读取超时只对幂等请求重试TIMEOUT_RETRIES次
+        '''
+        if len(errors) > self.retries:
+            return False
+        error = errors[-1]
+        if is_proxy_error(error):
+            return True
+        if isinstance(error, requests.exceptions.Timeout) and request.method in IDEMPOTENT_METHODS:
+            timeouts = sum(1 for e in errors if isinstance(e, requests.exceptions.Timeout) and not is_proxy_error(e))
+            return timeouts <= TIMEOUT_RETRIES
+        return False
+
+    def _evict(self, proxy):
+        proxy.evicted_until = time.monotonic() + proxy.cooldown
+        proxy.probation = False
+        # 重新试用时从头统计
+        proxy.failures = 0
+        proxy.samples = 0
+        proxy.fail_rate = 0.0
+        self._stats['evicted'] += 1
+
+    @staticmethod
+    def proxies_for(proxy):
+        '''传给requests的proxies'''
+        return {'http': proxy.url, 'https': proxy.url}
+
+    def stats(self):
+        '''代理数、可用代理数、剔除和恢复次数、等待空闲代理和无可用代理的请求数，以及各代理的明细'''
+        with self.cond:
+            stats = dict(self._stats)
+            stats['proxies'] = len(self.proxies)
+            stats['healthy'] = sum(1 for proxy in self.proxies if proxy.evicted_until is None)
+            stats['detail'] = [{'url': proxy.url, 'requests': proxy.requests, 'errors': proxy.errors,
+                                'srtt': round(proxy.srtt, 3) if proxy.srtt is not None else None,
+                                'evicted': proxy.evicted_until is not None} for proxy in self.proxies]
+        return stats
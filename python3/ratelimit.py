@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time,threading
+import urllib.parse
+
+# 目标返回429/503或超时后，该主机的速率减半，不低于MIN_RATE；未限速的主机从BACKOFF_RATE开始减
+MIN_RATE = 0.5
+BACKOFF_RATE = 20.0
+# 之后每个正常响应把速率提高RECOVERY倍，恢复到原速率(未限速的主机为BACKOFF_RATE的两倍)后取消退避
+RECOVERY = 1.05
+# Retry-After最多等待的秒数；并发请求的失败往往同时返回，间隔内的多次失败只减速一次
+MAX_PAUSE = 60.0
+THROTTLE_INTERVAL = 1.0
+THROTTLE_STATUS = (429, 503)
+
+
+class TokenBucket(object):
+    '''
+    令牌桶，rate为每秒补充的令牌数，burst为桶容量，rate为None时不限速
+    reserve预先扣除令牌，返回需要等待的秒数，调用方在锁外等待
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate or 1, 1)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.pause_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, now):
+        with self.lock:
+            wait = max(self.pause_until - now, 0.0)
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+
+class HostBucket(TokenBucket):
+    '''单个主机的令牌桶，按目标的反馈调整速率(乘性减、乘性恢复)'''
+    def __init__(self, rate, burst=None):
+        super(HostBucket, self).__init__(rate, burst)
+        self.base = rate
+        self.base_burst = self.burst
+        self.throttled_at = None
+
+    @property
+    def backing_off(self):
+        return self.rate != self.base
+
+    def throttle(self, now, retry_after=None):
+        with self.lock:
+            if self.throttled_at is None or now - self.throttled_at >= THROTTLE_INTERVAL:
+                self.throttled_at = now
+                if self.rate is None:
+                    self.tokens = 0.0
+                    self.stamp = now
+                self.rate = max((self.rate or BACKOFF_RATE * 2) / 2, MIN_RATE)
+                self.burst = min(self.burst, max(self.rate, 1))
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.pause_until = max(self.pause_until, now + min(pause, MAX_PAUSE))
+
+    def recover(self):
+        with self.lock:
+            if self.rate == self.base:
+                return
+            self.rate *= RECOVERY
+            if self.rate >= (self.base or BACKOFF_RATE * 2):
+                self.rate = self.base
+                self.burst = self.base_burst
+
+
+def host_key(url):
+    '''返回 (主机名:端口, 主机名)，同一主机名的不同端口视为不同站点'''
+    parts = urllib.parse.urlsplit(url)
+    hostname = parts.hostname or ''
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    return '%s:%s' % (hostname, port or (443 if parts.scheme == 'https' else 80)), hostname
+
+
+def retry_after(response):
+    '''Retry-After中的秒数，HTTP日期格式或无法解析时返回None'''
+    value = response.headers.get('Retry-After', '').strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+class RateLimiter(object):
+    '''
+    请求调度：按主机、按IP的令牌桶和全局令牌桶，速率单位为每秒请求数，None或0为不限
+    主机按 主机名:端口 区分(见host_key)
+    主机的IP在建立连接时记录(见httpclient._TimedConnection)，同一IP上的多个站点共用IP的限速
+    目标返回429/503或超时时对该主机退避，其他主机不受影响
+    '''
+    def __init__(self, host_rate=None, ip_rate=None, global_rate=None, burst=None):
+        self.host_rate = host_rate or None
+        self.ip_rate = ip_rate or None
+        self.burst = burst
+        self.global_bucket = TokenBucket(global_rate, burst) if global_rate else None
+        self.hosts = {}
+        self.ips = {}
+        self.addresses = {}
+        self.lock = threading.Lock()
+        self._stats = {'requests': 0, 'waited': 0, 'wait_seconds': 0.0, 'throttled': 0}
+
+    def _host_bucket(self, host):
+        with self.lock:
+            bucket = self.hosts.get(host)
+            if bucket is None:
+                bucket = self.hosts[host] = HostBucket(self.host_rate, self.burst)
+            return bucket
+
+    def _ip_bucket(self, hostname):
+        if not self.ip_rate:
+            return None
+        with self.lock:
+            ip = self.addresses.get(hostname)
+            if ip is None:
+                return None
+            bucket = self.ips.get(ip)
+            if bucket is None:
+                bucket = self.ips[ip] = TokenBucket(self.ip_rate, self.burst)
+            return bucket
+
+    def resolved(self, host, ip):
+        '''记录主机建立连接时使用的IP'''
+        host = host.lower()
+        if self.addresses.get(host) != ip:
+            with self.lock:
+                self.addresses[host] = ip
+
+    def acquire(self, url):
+        '''按各令牌桶等待到可以发出请求，返回等待的秒数'''
+        host, hostname = host_key(url)
+        now = time.monotonic()
+        buckets = [self._host_bucket(host), self._ip_bucket(hostname), self.global_bucket]
+        wait = max(bucket.reserve(now) for bucket in buckets if bucket is not None)
+        with self.lock:
+            self._stats['requests'] += 1
+            if wait > 0:
+                self._stats['waited'] += 1
+                self._stats['wait_seconds'] += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def feedback(self, url, response=None, timeout=False):
+        '''根据响应状态码或超时调整主机速率'''
+        bucket = self._host_bucket(host_key(url)[0])
+        if timeout or (response is not None and response.status_code in THROTTLE_STATUS):
+            bucket.throttle(time.monotonic(), retry_after(response) if response is not None else None)
+            with self.lock:
+                self._stats['throttled'] += 1
+        elif response is not None:
+            bucket.recover()
+
+    def stats(self):
+        '''请求数、需要等待的请求数、累计等待秒数、退避次数和当前仍在退避的主机数'''
+        with self.lock:
+            stats = dict(self._stats)
+            hosts = list(self.hosts.values())
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        stats['backing_off'] = sum(1 for bucket in hosts if bucket.backing_off)
+        return stats
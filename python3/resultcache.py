@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy,hashlib,threading
+from collections import OrderedDict
+
+# 缓存的结果条数，超过后淘汰最久未使用的
+MAX_ENTRIES = 10000
+# 每次响应都会变化的头只计入头名不计入值，指纹规则只会检查这些头是否存在
+VOLATILE_HEADERS = frozenset(('date', 'age', 'etag', 'last-modified', 'content-length', 'x-request-id', 'cf-ray'))
+
+
+class ResultCache(object):
+    '''
+    跨目标的指纹结果缓存：停放域名、CDN错误页、同一模板的站点返回完全相同的页面，识别结果也相同
+    键为引擎输入的哈希(状态码、除易变值外的响应头、响应体，以及引擎依赖的其他输入)，命中时直接复用结果
+    store为持久化的结果存储(需提供get_result/put_result，如archive.ResponseArchive)，内存中未命中时再查store，
+    增量扫描时上次扫描的结果可以直接复用
+    '''
+    def __init__(self, max_entries=MAX_ENTRIES, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self._stats = {}
+
+    @staticmethod
+    def digest(status, headers, content):
+        '''单个响应的哈希'''
+        h = hashlib.sha1(str(status).encode())
+        for name, value in sorted((str(k).lower(), str(v)) for k, v in headers.items()):
+            h.update(b'\n' + name.encode('utf-8', 'replace'))
+            if name not in VOLATILE_HEADERS:
+                h.update(b':' + value.encode('utf-8', 'replace'))
+        h.update(b'\n\n')
+        h.update(content or b'')
+        return h.digest()
+
+    @classmethod
+    def response_digest(cls, r):
+        return cls.digest(r.status_code, r.headers, r.content)
+
+    @staticmethod
+    def key(*parts):
+        '''由各响应的哈希和其他输入组成缓存键，parts为bytes或可以repr的值'''
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else repr(part).encode('utf-8', 'replace'))
+            h.update(b'\0')
+        return h.digest()
+
+    def _count(self, engine, name):
+        item = self._stats.get(engine)
+        if item is None:
+            item = self._stats[engine] = {'hits': 0, 'misses': 0}
+        item[name] += 1
+
+    def get(self, engine, key):
+        '''命中时返回结果的副本，未命中返回None'''
+        with self.lock:
+            value = self.entries.get((engine, key))
+            if value is not None:
+                self.entries.move_to_end((engine, key))
+                self._count(engine, 'hits')
+                return copy.deepcopy(value)
+        value = self.store.get_result(engine, key) if self.store is not None else None
+        with self.lock:
+            if value is None:
+                self._count(engine, 'misses')
+                return None
+            self._count(engine, 'hits')
+            self._add(engine, key, value)
+        return copy.deepcopy(value)
+
+    def _add(self, engine, key, value):
+        self.entries[(engine, key)] = value
+        self.entries.move_to_end((engine, key))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, engine, key, value):
+        value = copy.deepcopy(value)
+        with self.lock:
+            self._add(engine, key, value)
+        if self.store is not None:
+            self.store.put_result(engine, key, value)
+
+    def stats(self):
+        '''各引擎的命中次数、未命中次数和命中率'''
+        with self.lock:
+            stats = {engine: dict(item) for engine, item in self._stats.items()}
+        for item in stats.values():
+            total = item['hits'] + item['misses']
+            item['hit_rate'] = round(item['hits'] / total, 3) if total else 0.0
+        return stats
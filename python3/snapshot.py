@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+规则快照：把三个引擎的规则预处理后保存为一个文件，启动时一次读取即可使用
+    fofa: tide表的规则表达式预先解析为条件组
+    Wappalyzer: technologies.json 归一化后的结构
+    webanalyzer: 规则目录下的全部规则和favicon索引
+    目录探测: cms表的全部指纹
+快照中的正则只保存表达式和预先提取的必需字面量，第一次使用时才编译，文本不含该字面量时直接跳过
+快照记录了各规则源的大小和修改时间，规则源变化后快照自动失效，需要重新生成
+快照使用pickle保存，只加载自己生成的快照文件
+
+    Usage: python3 snapshot.py [-o rules.snapshot] [-b 1]
+
+    -o: 快照文件路径，默认为当前目录下的rules.snapshot
+    -b: 指定为1时生成快照后对比从规则源加载和从快照加载的耗时
+'''
+
+import os,sys,json,time,pickle,getopt,sqlite3
+
+from lazyregex import LazyRegex, required_literal
+
+SNAPSHOT_VERSION = 3
+DEFAULT_NAME = 'rules.snapshot'
+TECHNOLOGIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'technologies.json')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def default_paths():
+    '''与TideFinger一致，指纹库和webanalyzer规则都在当前目录下'''
+    pwd = os.getcwd()
+    return (os.path.join(pwd, DEFAULT_NAME), os.path.join(pwd, 'cms_finger.db'),
+            os.path.join(pwd, 'webanalyzer', 'rules'))
+
+
+def sources(db_path, rule_dir):
+    '''
+    规则源的 (大小, 修改时间)，规则目录检查目录本身、各分类目录和其中的每个规则文件
+    就地修改规则文件不会改变目录的修改时间，只检查目录时快照会继续使用旧规则
+    '''
+    paths = [db_path, TECHNOLOGIES_FILE, rule_dir]
+    if os.path.isdir(rule_dir):
+        for rule_type in sorted(os.listdir(rule_dir)):
+            rule_type_dir = os.path.join(rule_dir, rule_type)
+            paths.append(rule_type_dir)
+            if os.path.isdir(rule_type_dir):
+                paths.extend(os.path.join(rule_type_dir, x) for x in sorted(os.listdir(rule_type_dir)))
+    result = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            result[path] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            result[path] = None
+    return result
+
+
+def _lazy_wappalyzer(technologies):
+    from Wappalyzer import Wappalyzer
+    for technology in technologies.values():
+        for pattern in Wappalyzer.iter_patterns(technology):
+            regex = pattern['regex']
+            regex.literal = required_literal(regex.pattern, regex.flags)
+            # 匹配时会就地把confidence转成整数，提前归一化，多线程共享时不再写入
+            pattern['confidence'] = int(pattern.get('confidence', 100))
+
+
+def _lazy_webanalyzer(rules):
+    for rule in rules.values():
+        for match in rule['matches']:
+            regex = match.get('regexp')
+            if regex is not None and not isinstance(regex, LazyRegex):
+                match['regexp'] = LazyRegex(regex.pattern, regex.flags, required_literal(regex.pattern, regex.flags))
+
+
+def build(path, db_path, rule_dir):
+    '''从规则源生成快照，返回各部分的规则数'''
+    import TideFinger
+    from Wappalyzer import Wappalyzer
+    from webanalyzer import webanalyzer
+
+    with sqlite3.connect(db_path) as conn:
+        fofa = [(_id, name, TideFinger.parse_fofa_key(key))
+                for _id, name, key in conn.execute('SELECT id, name, keys FROM `tide` ORDER BY id')]
+        cms_rows = conn.execute('select * from cms order by hit').fetchall()
+
+    with open(TECHNOLOGIES_FILE, 'r', encoding='utf-8') as fd:
+        obj = json.load(fd)
+    wappalyzer = Wappalyzer(categories=obj['categories'], technologies=obj['technologies'])
+    _lazy_wappalyzer(wappalyzer.technologies)
+
+    analyzer = webanalyzer._new_analyzer()
+    analyzer.rule_dir = rule_dir
+    analyzer.cms_db = db_path
+    analyzer.reload_rules()
+    _lazy_webanalyzer(webanalyzer.RULES)
+
+    data = {
+        'version': SNAPSHOT_VERSION,
+        'created': time.time(),
+        'sources': sources(db_path, rule_dir),
+        'fofa': fofa,
+        'cms_rows': cms_rows,
+        'wappalyzer': {'categories': wappalyzer.categories, 'technologies': wappalyzer.technologies},
+        'webanalyzer': {'rules': webanalyzer.RULES, 'rule_types': webanalyzer.RULE_TYPES,
+                        'favicon_index': webanalyzer.FAVICON_INDEX},
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fd:
+        pickle.dump(data, fd, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return {'fofa': len(fofa), 'cms': len(cms_rows), 'wappalyzer': len(wappalyzer.technologies),
+            'webanalyzer': len(webanalyzer.RULES), 'bytes': os.path.getsize(path)}
+
+
+def load(path, db_path, rule_dir):
+    '''读取快照，文件不存在返回None，版本不符或规则源已变化时抛出SnapshotError'''
+    try:
+        with open(path, 'rb') as fd:
+            raw = fd.read()
+    except FileNotFoundError:
+        return None
+    try:
+        data = pickle.loads(raw)
+    except Exception as e:
+        raise SnapshotError('规则快照%s无法读取: %s' % (path, e))
+    if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError('规则快照%s版本不符，请重新生成' % path)
+    if data['sources'] != sources(db_path, rule_dir):
+        raise SnapshotError('规则快照%s生成后规则源已更新，请重新生成' % path)
+    return data
+
+
+def benchmark(path, db_path, rule_dir):
+    '''对比从规则源加载和从快照加载全部规则的耗时(秒)'''
+    import TideFinger
+    from Wappalyzer import Wappalyzer
+    from webanalyzer import webanalyzer
+
+    start = time.perf_counter()
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute('SELECT id, name, keys FROM `tide` ORDER BY id').fetchall()
+        TideFinger.CmsMd5Index(conn.execute('select * from cms order by hit').fetchall())
+    [TideFinger.parse_fofa_key(key) for _id, name, key in rows]
+    Wappalyzer.latest()
+    analyzer = webanalyzer._new_analyzer()
+    analyzer.rule_dir = rule_dir
+    analyzer.cms_db = db_path
+    analyzer.reload_rules()
+    from_sources = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = load(path, db_path, rule_dir)
+    TideFinger.CmsMd5Index(data['cms_rows'])
+    Wappalyzer(data['wappalyzer']['categories'], data['wappalyzer']['technologies'], prepared=True)
+    webanalyzer.WebAnalyzer.install_rules(**data['webanalyzer'])
+    from_snapshot = time.perf_counter() - start
+    return {'sources_seconds': round(from_sources, 3), 'snapshot_seconds': round(from_snapshot, 3)}
+
+
+if __name__ == "__main__":
+    try:
+        options, args = getopt.getopt(sys.argv[1:], "o:b:")
+    except getopt.GetoptError as e:
+        exit(str(e))
+    path, db_path, rule_dir = default_paths()
+    bench = False
+    for opt, arg in options:
+        if opt == '-o':
+            path = arg
+        elif opt == '-b':
+            bench = arg == '1'
+
+    if not os.path.exists(db_path):
+        exit('指纹库%s不存在' % db_path)
+    start = time.perf_counter()
+    stats = build(path, db_path, rule_dir)
+    print("snapshot %s built in %.3fs: %s" % (path, time.perf_counter() - start, stats))
+    if bench:
+        print("rule loading:", benchmark(path, db_path, rule_dir))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time,threading
+from contextlib import contextmanager
+
+REQUEST_METRICS = ('wait', 'dns', 'connect', 'ttfb', 'download')
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class Timings(object):
+    '''
+    单个目标的分阶段耗时
+    stages: 各处理阶段(解析、匹配等)累计耗时
+    requests: 按请求类型汇总的 wait/dns/connect/ttfb/download 耗时
+    details: 除目录探测外每个请求的明细
+    truncated: 响应体超过大小上限被截断的url
+    cached: 结果取自跨目标结果缓存(resultcache)的引擎
+    '''
+    detail_skip = ('probe',)
+
+    def __init__(self):
+        self.stages = {}
+        self.requests = {}
+        self.details = []
+        self.truncated = []
+        self.cached = []
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # 流水线模式下随抓取结果传给工作进程，锁不能序列化
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_cached(self, engine):
+        with self.lock:
+            self.cached.append(engine)
+
+    def add_request(self, kind, url, metrics):
+        with self.lock:
+            summary = self.requests.setdefault(kind, dict({'count': 0}, **{x: 0.0 for x in REQUEST_METRICS}))
+            summary['count'] += 1
+            for x in REQUEST_METRICS:
+                summary[x] += metrics.get(x, 0.0)
+            if metrics.get('truncated'):
+                self.truncated.append(url)
+            if kind not in self.detail_skip:
+                detail = {'kind': kind, 'url': url}
+                detail.update({x: _ms(metrics.get(x, 0.0)) for x in REQUEST_METRICS})
+                self.details.append(detail)
+
+    def to_dict(self):
+        with self.lock:
+            requests = {}
+            for kind, summary in self.requests.items():
+                requests[kind] = {x: _ms(summary[x]) for x in REQUEST_METRICS}
+                requests[kind]['count'] = summary['count']
+            return {
+                'stages': {name: _ms(seconds) for name, seconds in self.stages.items()},
+                'requests': requests,
+                'details': list(self.details),
+            }
+
+
+class Histogram(object):
+    '''批量扫描时汇总各阶段耗时分布(毫秒)'''
+    bounds = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def _add(self, name, ms):
+        item = self.data.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                           'buckets': [0] * (len(self.bounds) + 1)})
+        item['count'] += 1
+        item['sum'] += ms
+        item['max'] = max(item['max'], ms)
+        for index, bound in enumerate(self.bounds):
+            if ms <= bound:
+                item['buckets'][index] += 1
+                break
+        else:
+            item['buckets'][-1] += 1
+
+    def add(self, timings):
+        '''timings为Timings.to_dict()的结果'''
+        with self.lock:
+            for name, ms in timings.get('stages', {}).items():
+                self._add(name, ms)
+            for kind, summary in timings.get('requests', {}).items():
+                for x in REQUEST_METRICS:
+                    self._add('%s.%s' % (kind, x), summary[x] / max(summary['count'], 1))
+
+    def to_dict(self):
+        with self.lock:
+            result = {}
+            for name, item in self.data.items():
+                result[name] = {
+                    'count': item['count'],
+                    'avg': round(item['sum'] / item['count'], 1),
+                    'max': item['max'],
+                    'buckets': {('<=%d' % bound): num for bound, num in zip(self.bounds, item['buckets']) if num},
+                }
+                if item['buckets'][-1]:
+                    result[name]['buckets']['>%d' % self.bounds[-1]] = item['buckets'][-1]
+            return result
+
+    def report(self):
+        lines = ['%-28s %8s %10s %10s  %s' % ('stage', 'count', 'avg(ms)', 'max(ms)', 'distribution')]
+        for name, item in sorted(self.to_dict().items()):
+            buckets = ' '.join('%s:%d' % (k, v) for k, v in item['buckets'].items())
+            lines.append('%-28s %8d %10.1f %10.1f  %s' % (name, item['count'], item['avg'], item['max'], buckets))
+        return '\n'.join(lines)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import base64
+import struct
+import sqlite3
+import hashlib
+import logging
+import urllib.parse
+
+__all__ = ["FaviconIndex", "favicon_hash"]
+
+logger = logging.getLogger(__file__)
+
+FAVICON_KEYS = {'url', 'md5', 'favicon_hash', 'certainty'}
+
+
+def _mmh3_32(data: bytes, seed: int = 0) -> int:
+    """
+    murmurhash3 x86 32bit, same result as `mmh3.hash`
+
+    >>> _mmh3_32(b'')
+    0
+    >>> _mmh3_32(b'hello')
+    613153351
+    >>> _mmh3_32(b'foo')
+    -156908512
+    >>> _mmh3_32(b'The quick brown fox jumps over the lazy dog')
+    776992547
+    >>> _mmh3_32(b'abc', seed=1)
+    -1435112961
+    """
+    c1, c2 = 0xcc9e2d51, 0x1b873593
+    length = len(data)
+    h = seed & 0xffffffff
+    rounded = length & ~3
+
+    for i in range(0, rounded, 4):
+        k = struct.unpack_from('<I', data, i)[0]
+        k = (k * c1) & 0xffffffff
+        k = ((k << 15) | (k >> 17)) & 0xffffffff
+        k = (k * c2) & 0xffffffff
+        h ^= k
+        h = ((h << 13) | (h >> 19)) & 0xffffffff
+        h = (h * 5 + 0xe6546b64) & 0xffffffff
+
+    k = 0
+    tail = length & 3
+    if tail == 3:
+        k ^= data[rounded + 2] << 16
+    if tail >= 2:
+        k ^= data[rounded + 1] << 8
+    if tail >= 1:
+        k ^= data[rounded]
+        k = (k * c1) & 0xffffffff
+        k = ((k << 15) | (k >> 17)) & 0xffffffff
+        k = (k * c2) & 0xffffffff
+        h ^= k
+
+    h ^= length
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & 0xffffffff
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & 0xffffffff
+    h ^= h >> 16
+
+    return h - 0x100000000 if h & 0x80000000 else h
+
+
+def favicon_hash(content: bytes) -> int:
+    """favicon hash used by shodan / fofa: mmh3 of the base64 encoded content"""
+    return _mmh3_32(base64.encodebytes(content))
+
+
+def _is_root_favicon(url: str) -> bool:
+    """only /favicon.ico is fetched for every target, icons under other paths are checked where they are"""
+    return urllib.parse.urlsplit(url).path == '/favicon.ico'
+
+
+class FaviconIndex(object):
+    """
+    Map favicon hashes (md5 and mmh3) to products, so that a favicon
+    only costs one dictionary lookup instead of a walk over all rules.
+    """
+
+    def __init__(self):
+        self.md5 = {}
+        self.mmh3 = {}
+        self.rules = set()
+
+    def __len__(self):
+        return len(self.md5) + len(self.mmh3)
+
+    def add(self, result: dict, md5: str = None, mmh3: int = None):
+        if md5:
+            self.md5.setdefault(md5.lower(), []).append(result)
+        if mmh3 is not None:
+            self.mmh3.setdefault(int(mmh3), []).append(result)
+
+    def load_rules(self, rules: dict) -> int:
+        """
+        Index rules which only consist of md5 or favicon_hash (shodan / fofa
+        mmh3) matches on /favicon.ico. Keys of these rules are kept in
+        `self.rules` so the caller can skip them in the linear walk; rules on
+        other icon paths stay in the walk.
+        """
+        count = 0
+        for key, rule in rules.items():
+            matches = rule.get('matches', [])
+            if not matches or 'condition' in rule:
+                continue
+
+            if not all(('md5' in match or 'favicon_hash' in match) and 'url' in match and _is_root_favicon(match['url'])
+                       and FAVICON_KEYS.issuperset(match.keys()) for match in matches):
+                continue
+
+            result = {'name': rule['name'], 'origin': rule['origin']}
+            for match in matches:
+                self.add(result, md5=match.get('md5'), mmh3=match.get('favicon_hash'))
+            self.rules.add(key)
+            count += 1
+
+        return count
+
+    def load_cms(self, db_path: str) -> int:
+        """
+        index md5 / mmh3 rows of the `cms` table whose path is /favicon.ico
+        the shipped cms table only has md5 and keyword rows, mmh3 rows
+        (options='mmh3', match_pattern is the favicon_hash) have to be added
+        """
+        if not db_path or not os.path.isfile(db_path):
+            return 0
+
+        count = 0
+        try:
+            with sqlite3.connect(db_path) as conn:
+                rows = conn.execute("SELECT cms_name, path, match_pattern, options FROM cms "
+                                    "WHERE options IN ('md5', 'mmh3')")
+                for cms_name, path, match_pattern, options in rows:
+                    if not path or not _is_root_favicon(path):
+                        continue
+
+                    result = {'name': cms_name, 'origin': 'cms'}
+                    if options == 'md5':
+                        self.add(result, md5=match_pattern)
+                    else:
+                        self.add(result, mmh3=match_pattern)
+                    count += 1
+        except sqlite3.Error as e:
+            logger.error('load favicon rows from %s failed, error: %s' % (db_path, e))
+
+        return count
+
+    def lookup(self, content: bytes, md5: str = None) -> list:
+        if not content:
+            return []
+
+        md5 = md5 or hashlib.md5(content).hexdigest()
+        results = list(self.md5.get(md5, []))
+        if self.mmh3:
+            results.extend(self.mmh3.get(favicon_hash(content), []))
+
+        seen = set()
+        unique = []
+        for result in results:
+            if result['name'] in seen:
+                continue
+            seen.add(result['name'])
+            unique.append(dict(result))
+        return unique
@@ -4,6 +4,7 @@
 import os
 import re
 import json
+import time
 import urllib3
 import hashlib
 import logging
@@ -13,6 +14,7 @@ import urllib.request
 from bs4 import BeautifulSoup
 from webanalyzer.utils import update
 from webanalyzer.condition import Condition
+from webanalyzer.favicon import FaviconIndex, favicon_hash
 
 __all__ = ["WebAnalyzer"]
 
@@ -21,6 +23,7 @@ logger = logging.getLogger(__file__)
 
 RULES = {}
 RULE_TYPES = set()
+FAVICON_INDEX = FaviconIndex()
 DEFAULT_RULE_DIR = os.path.join(os.getcwd(), "webanalyzer/rules")
 REPOSITORY = "webanalyzer/rules"
 
@@ -40,6 +43,12 @@ class WebAnalyzer(object):
     'Cookie':"PHPSESSID=gljsd5c3ei5n813roo4878q203"}
 
         self.rule_dir = DEFAULT_RULE_DIR
+        self.cms_db = None
+        self.session = requests
+        self.timings = None
+        self.profiler = None
+        # 跨目标的结果缓存(需提供digest/key/get/put)，主页面和图标都相同时直接复用结果
+        self.cache = None
 
         self._targets = {}
         self._cond_parser = Condition()
@@ -52,7 +61,7 @@ class WebAnalyzer(object):
         return RULES
 
     def reload_rules(self) -> int:
-        global RULES, RULE_TYPES
+        global RULES, RULE_TYPES, FAVICON_INDEX
         new_rules = {}
         new_rule_types = set()
         for rule_type in os.listdir(self.rule_dir):
@@ -80,8 +89,24 @@ class WebAnalyzer(object):
                     except Exception as e:
                         logger.error('parse %s failed, error: %s' % (i, e))
 
+        favicon_index = FaviconIndex()
+        favicon_index.load_rules(new_rules)
+        favicon_index.load_cms(self.cms_db)
+
         RULES = new_rules
         RULE_TYPES = new_rule_types
+        FAVICON_INDEX = favicon_index
+        return len(RULES)
+
+    @staticmethod
+    def install_rules(rules: dict, rule_types: set, favicon_index: FaviconIndex) -> int:
+        """
+        use rules loaded elsewhere (e.g. from a rule snapshot) instead of the rule directory
+        """
+        global RULES, RULE_TYPES, FAVICON_INDEX
+        RULES = rules
+        RULE_TYPES = rule_types
+        FAVICON_INDEX = favicon_index
         return len(RULES)
 
     def test_rule(self, url: str, rule_path: str) -> hash:
@@ -112,14 +137,16 @@ class WebAnalyzer(object):
 
     def _request(self, url: str) -> hash:
         try:
-            rp = requests.get(url, headers=self.headers, verify=False, timeout=self.timeout,
-                              allow_redirects=self.allow_redirect)
+            rp = self.session.get(url, headers=self.headers, verify=False, timeout=self.timeout,
+                                  allow_redirects=self.allow_redirect)
         except Exception as e:
             logger.error("request error: %s" % str(e))
             return
 
+        start = time.perf_counter()
         script = []
         meta = {}
+        icons = []
 
         p = BeautifulSoup(rp.text, "html5lib")
 
@@ -134,6 +161,10 @@ class WebAnalyzer(object):
             if meta_name:
                 meta[meta_name] = meta_content
 
+        for data in p.find_all("link", rel=True, href=True):
+            if 'icon' in [i.lower() for i in data.get("rel")]:
+                icons.append(urllib.parse.urljoin(url, data.get("href")))
+
         title = p.find("title")
         if title:
             title = title.text
@@ -141,6 +172,7 @@ class WebAnalyzer(object):
             title = ""
 
         raw_headers = '\n'.join('{}: {}'.format(k, v) for k, v in rp.headers.items())
+        self._add_timing('webanalyzer_parse', time.perf_counter() - start)
         self._targets[url] = {
             "url": url,
             "body": rp.text,
@@ -148,18 +180,24 @@ class WebAnalyzer(object):
             "status": rp.status_code,
             "script": script,
             "meta": meta,
+            "icons": icons,
             "title": title,
             "cookies": rp.cookies,
             "raw_cookies": rp.headers.get("set-cookie", ""),
             "raw_response": raw_headers + rp.text,
             "raw_headers": raw_headers,
+            "content": rp.content,
             "md5": hashlib.md5(rp.content).hexdigest(),
         }
 
         return self._targets[url]
 
+    def _add_timing(self, stage: str, seconds: float):
+        if self.timings is not None:
+            self.timings.add(stage, seconds)
+
     def _check_match(self, match: hash, aggression: bool = False) -> (bool, str):
-        s = {'regexp', 'text', 'md5', 'status'}  # 如果增加新的检测方式，需要修改这里
+        s = {'regexp', 'text', 'md5', 'favicon_hash', 'status'}  # 如果增加新的检测方式，需要修改这里
         if not s.intersection(list(match.keys())):
             return False, None
 
@@ -199,8 +237,6 @@ class WebAnalyzer(object):
                         return False, None
                     search_context = target[i][key]
 
-            match.pop('search')
-
         version = match.get('version', None)
         for key in list(match.keys()):
             if key == 'status':
@@ -211,6 +247,12 @@ class WebAnalyzer(object):
                 if target['md5'] != match['md5']:
                     return False, None
 
+            if key == 'favicon_hash':
+                if 'favicon_hash' not in target:
+                    target['favicon_hash'] = favicon_hash(target['content'])
+                if target['favicon_hash'] != int(match['favicon_hash']):
+                    return False, None
+
             if key == 'text':
                 search_contexts = search_context
                 if isinstance(search_context, str):
@@ -287,34 +329,75 @@ class WebAnalyzer(object):
         implies = set()
         excludes = set()
 
-        if not self._request(url):
+        target = self._request(url)
+        if not target:
             logger.info("request %s failed" % url)
             return
 
-        self._request(urllib.parse.urljoin(url, '/favicon.ico'))
+        favicon_url = urllib.parse.urljoin(url, '/favicon.ico')
+        # /favicon.ico and the icon declared by <link rel=icon> are both looked up in the favicon index
+        favicons = [self._request(favicon_url)]
+        for icon_url in target['icons']:
+            if icon_url != favicon_url and icon_url.startswith(('http://', 'https://')):
+                favicons.append(self._request(icon_url))
+                break
 
         if reload:
+            start = time.perf_counter()
             self.reload_rules()
+            self._add_timing('webanalyzer_load', time.perf_counter() - start)
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(*[self.cache.digest(t['status'], t['headers'], t['content'])
+                                   for t in self._targets.values()])
+            cached = self.cache.get('webanalyzer', key)
+            if cached is not None:
+                if self.timings is not None:
+                    self.timings.add_cached('webanalyzer')
+                return cached
+
+        start = time.perf_counter()
+        matched = []
+        # favicon only rules are resolved by the hash index
+        seen = set()
+        for favicon in favicons:
+            if not favicon:
+                continue
+            for r in FAVICON_INDEX.lookup(favicon['content'], favicon['md5']):
+                if r['name'] not in seen:
+                    seen.add(r['name'])
+                    matched.append((RULES.get('%s_%s' % (r['origin'], r['name']), {}), r))
 
         for name, rule in RULES.items():
-            # print(name)
-            r = self._check_rule(rule)
+            if name in FAVICON_INDEX.rules:
+                continue
+
+            if self.profiler is None:
+                r = self._check_rule(rule)
+            else:
+                rule_start = time.perf_counter()
+                r = self._check_rule(rule)
+                self.profiler.record('webanalyzer', name, time.perf_counter() - rule_start, bool(r))
             if r:
-                if 'implies' in rule:
-                    if isinstance(rule['implies'], str):
-                        implies.add(rule['implies'])
-                    else:
-                        implies.update(rule['implies'])
+                matched.append((rule, r))
 
-                if 'excludes' in rule:
-                    if isinstance(rule['excludes'], str):
-                        excludes.add(rule['excludes'])
-                    else:
-                        excludes.update(rule['excludes'])
+        for rule, r in matched:
+            if 'implies' in rule:
+                if isinstance(rule['implies'], str):
+                    implies.add(rule['implies'])
+                else:
+                    implies.update(rule['implies'])
 
-                if r['name'] in excludes:
-                    continue
-                results.append(r)
+            if 'excludes' in rule:
+                if isinstance(rule['excludes'], str):
+                    excludes.add(rule['excludes'])
+                else:
+                    excludes.update(rule['excludes'])
+
+            if r['name'] in excludes:
+                continue
+            results.append(r)
 
         for imply in implies:
             _result = {
@@ -339,29 +422,51 @@ class WebAnalyzer(object):
                 continue
             results.append(_result)
 
+        self._add_timing('webanalyzer_match', time.perf_counter() - start)
+        if key is not None:
+            self.cache.put('webanalyzer', key, results)
         return results
 
-def check(url, update):
+def _new_analyzer():
     w = WebAnalyzer()
     w.rule_dir = os.path.join(os.getcwd(), "webanalyzer/rules")
+    w.cms_db = os.path.join(os.getcwd(), "cms_finger.db")
+    w.aggression = 0
+    w.allow_redirect = True
+    return w
 
-    if update:
-        if w.update_rules():
-            print("update rules done")
-        return
 
-    w.aggression = 0
+def analyze(url, session=None, timings=None, profiler=None, reload=True, timeout=None, cache=None):
+    w = _new_analyzer()
+    w.cache = cache
+    if session:
+        w.session = session
+    if timeout is not None:
+        w.timeout = timeout
+    w.timings = timings
+    w.profiler = profiler
+    r = w.start(url, reload=reload)
+    return r or []
 
-    w.allow_redirect = True
 
-    r = w.start(url)
-    # if r:
-    #     click.echo(json.dumps(r, indent=4))
+def banner(results):
     banner = []
-    for x in r:
+    for x in results:
         # print(x)
         if 'version' in x.keys():
             banner.append(x['name']+' '+x['version'])
         else:
             banner.append(x['name'])
     return banner
+
+
+def check(url, update):
+    if update:
+        if _new_analyzer().update_rules():
+            print("update rules done")
+        return
+
+    r = analyze(url)
+    # if r:
+    #     click.echo(json.dumps(r, indent=4))
+    return banner(r)